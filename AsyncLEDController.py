@@ -0,0 +1,297 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import paho.mqtt.client as mqtt
+
+from SimpleLEDController import SimpleLEDController
+
+
+class AsyncLEDController(SimpleLEDController):
+    """
+    SimpleLEDController driven by the asyncio event loop instead of paho's network thread.
+
+    The client socket is watched with loop.add_reader/add_writer, so connecting does not
+    block and callers can await readiness and publishes:
+
+        controller = AsyncLEDController(broker_ip, broker_port)
+        await controller.start()
+        await controller.connected()
+        await controller.update_leds({0: (255, 0, 0)})
+    """
+
+    def __init__(self, broker_ip="test.mosquitto.org", broker_port=1883, db_path="led_boards.db", num_connections=1):
+        self.loop = None
+        self._loop_thread = None
+        self._connected = None
+        self._connected_clients = set()
+        self._misc_tasks: Dict[mqtt.Client, asyncio.Task] = {}
+        self._cleanup_task = None
+        self._publish_waiters: Dict[tuple, asyncio.Future] = {}  # (client, mid) -> future
+        # Reconnect with exponential backoff after a failed connect or a dropped connection
+        self.reconnect_min_delay = 1
+        self.reconnect_max_delay = 60
+        self._reconnect_delays: Dict[mqtt.Client, float] = {}
+        self._reconnect_tasks: Dict[mqtt.Client, asyncio.Task] = {}
+        self._stopping = False
+        # SQLite writes run on one worker thread, in order, instead of blocking the event loop
+        self._db_executor = None
+        super().__init__(broker_ip, broker_port, db_path, num_connections)
+
+        for client in self.clients:
+            client.on_socket_open = self._on_socket_open
+            client.on_socket_close = self._on_socket_close
+            client.on_socket_register_write = self._on_socket_register_write
+            client.on_socket_unregister_write = self._on_socket_unregister_write
+            client.on_publish = self._on_publish
+            client.on_disconnect = self._on_disconnect
+            if client is not self.client:
+                client.on_connect = self._on_pool_connect
+
+    def _connect(self):
+        # Connection happens in start(), on the event loop
+        pass
+
+    def _start_cleanup(self):
+        # Cleanup runs as a task on the event loop, see start()
+        pass
+
+    async def start(self):
+        """Begin connecting to the broker without blocking the event loop."""
+        self.loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._connected = asyncio.Event()
+        self._stopping = False
+        if self._db_executor is None:
+            self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="led-db")
+        await asyncio.gather(*(self._start_client(client) for client in self.clients))
+        if self._cleanup_task is None:
+            self._cleanup_task = asyncio.ensure_future(self._cleanup_loop())
+
+    async def _start_client(self, client: mqtt.Client):
+        client.connect_async(self.broker_ip, self.broker_port, 60)
+        try:
+            # Resolves the host and opens the TCP connection; the CONNACK arrives via add_reader
+            await self.loop.run_in_executor(None, client.reconnect)
+        except Exception as e:
+            print(f"Connection failed: {str(e)}")
+            self._schedule_reconnect(client)
+
+    def _schedule_reconnect(self, client: mqtt.Client):
+        """Start reconnecting client in the background, unless already doing so or stopping."""
+        if self._stopping or client in self._reconnect_tasks:
+            return
+        self._reconnect_tasks[client] = asyncio.ensure_future(self._reconnect_loop(client))
+
+    async def _reconnect_loop(self, client: mqtt.Client):
+        try:
+            while not self._stopping:
+                delay = self._reconnect_delays.get(client, self.reconnect_min_delay)
+                # Doubles until a CONNACK is accepted, see _on_pool_connect
+                self._reconnect_delays[client] = min(delay * 2, self.reconnect_max_delay)
+                print(f"Reconnecting in {delay}s")
+                await asyncio.sleep(delay)
+                try:
+                    await self.loop.run_in_executor(None, client.reconnect)
+                    return  # Socket is open again; a refused CONNACK disconnects and lands back here
+                except Exception as e:
+                    print(f"Reconnect failed: {str(e)}")
+        finally:
+            self._reconnect_tasks.pop(client, None)
+
+    async def connected(self, timeout=None):
+        """Wait until the broker has accepted every connection."""
+        await asyncio.wait_for(self._connected.wait(), timeout)
+
+    def is_connected(self) -> bool:
+        return self._connected is not None and self._connected.is_set()
+
+    async def stop(self, timeout=10):
+        """Wait (up to timeout seconds) for queued publishes, then disconnect."""
+        self._stopping = True
+        for task in list(self._reconnect_tasks.values()):
+            task.cancel()
+        await self.flush(timeout)
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+            self._cleanup_task = None
+        for client in self.clients:
+            client.disconnect()
+        if self._db_executor is not None:
+            executor, self._db_executor = self._db_executor, None
+            await self.loop.run_in_executor(None, executor.shutdown)  # Let queued writes finish
+
+    async def _cleanup_loop(self):
+        while True:
+            await asyncio.sleep(10)  # Check every 10 seconds
+            self._run_db(self._write_offline, self._expire_inactive_boards())
+            self._run_db(self._prune_history)
+
+    def _update_board_heartbeat(self, board_id: str, status: str):
+        # Runs on the event loop (via loop_read): only the in-memory update happens here
+        current_time = datetime.now()
+        self.active_boards[board_id] = current_time
+        self._run_db(self._write_heartbeat, board_id, status, current_time)
+
+    def _run_db(self, write, *args):
+        """Run a database write on the DB thread, logging failures."""
+        if self._db_executor is None:
+            return
+        future = self.loop.run_in_executor(self._db_executor, write, *args)
+        future.add_done_callback(self._on_db_done)
+
+    @staticmethod
+    def _on_db_done(future):
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Database write failed: {str(future.exception())}")
+
+    def _on_loop(self, callback, *args):
+        """Run a socket callback now if on the loop thread, otherwise hand it to the loop."""
+        if threading.get_ident() == self._loop_thread:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    # Socket callbacks fire on the executor thread during reconnect() and on the loop afterwards.
+    # Every client in the pool has its own socket, watched independently.
+    def _on_socket_open(self, client, userdata, sock):
+        self._on_loop(self._watch_socket, client, sock)
+
+    def _watch_socket(self, client, sock):
+        self.loop.add_reader(sock, client.loop_read)
+        if client not in self._misc_tasks:
+            self._misc_tasks[client] = asyncio.ensure_future(self._misc_loop(client))
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._on_loop(self._unwatch_socket, client, sock)
+
+    def _unwatch_socket(self, client, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        self._release_waiters(client)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._on_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._on_loop(self.loop.remove_writer, sock)
+
+    async def _misc_loop(self, client):
+        """Keepalive pings and timeouts, which paho's own thread would otherwise handle."""
+        try:
+            while client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+                await asyncio.sleep(1)
+        finally:
+            self._misc_tasks.pop(client, None)
+        # loop_misc reports MQTT_ERR_NO_CONN once the connection is gone (e.g. a keepalive timeout)
+        self._schedule_reconnect(client)
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        super()._on_connect(client, userdata, flags, rc, properties)
+        self._on_pool_connect(client, userdata, flags, rc, properties)
+
+    def _on_pool_connect(self, client, userdata, flags, rc, properties=None):
+        if rc == 0:
+            self._reconnect_delays.pop(client, None)
+            self._connected_clients.add(client)
+            if len(self._connected_clients) == len(self.clients):
+                self._connected.set()
+        elif client is not self.client:
+            print(f"Connection failed with code {rc}")
+
+    def _on_disconnect(self, client, userdata, rc, properties=None):
+        self._on_loop(self._handle_disconnect, client)
+
+    def _handle_disconnect(self, client):
+        self._connected_clients.discard(client)
+        if self._connected is not None:
+            self._connected.clear()
+        self._release_waiters(client)
+        self._schedule_reconnect(client)
+
+    def _release_waiters(self, client):
+        """
+        Resolve every publish still waiting on client's connection. The frames are lost with the
+        socket (or resent stale after a reconnect), so as with a publish made while disconnected
+        there is nothing left to wait for.
+        """
+        for key in [key for key in self._publish_waiters if key[0] is client]:
+            waiter = self._publish_waiters.pop(key)
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _on_publish(self, client, userdata, mid, *args):
+        waiter = self._publish_waiters.pop((client, mid), None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def _publish_payload(self, board_id: str, payload: str) -> asyncio.Future:
+        waiter = self.loop.create_future()
+        info = self._publish_to_board(board_id, payload)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            waiter.set_result(None)  # Not connected; nothing to wait for
+        elif info.is_published():
+            waiter.set_result(None)
+        else:
+            self._publish_waiters[(self.clients[self._connection_for(board_id)], info.mid)] = waiter
+        return waiter
+
+    async def publish_batch(self, messages: List[Dict], boards: Optional[List[str]] = None):
+        """Publish messages to boards (default: every target board), resolving once all are written to the socket."""
+        waiters = []
+        if boards is None:
+            boards = self._target_boards()
+        for message in messages:
+            payload = self._encode(message)
+            for board_id in boards:
+                waiters.append(self._publish_payload(board_id, payload))
+        self._record_frame(boards, messages)
+        if waiters:
+            await asyncio.gather(*waiters)
+
+    async def replay_last_frames(self):
+        """Awaitable replay_last_frames: resend each board's last frame."""
+        waiters = [self._publish_payload(board_id, payload) for board_id, payload in self._replay_payloads()]
+        if waiters:
+            await asyncio.gather(*waiters)
+
+    async def flush(self, timeout=10) -> bool:
+        """Wait up to timeout seconds for every publish still queued in paho. Returns False on timeout."""
+        if not self._publish_waiters:
+            return True
+        # asyncio.wait rather than wait_for: the waiters are shared with publish_batch callers, don't cancel them
+        _, pending = await asyncio.wait(list(self._publish_waiters.values()), timeout=timeout)
+        if pending:
+            print(f"Flush timed out with {len(pending)} publishes pending")
+        return not pending
+
+    async def update_leds(self, led_colors: Dict[int, tuple], only_changed: bool = False):
+        """Awaitable set_multiple_leds: one batch of leds_hex messages per board layout (or per
+        set of changes, with only_changed)."""
+        if not self.current_board:
+            print("No board selected!")
+            return
+        await asyncio.gather(*(self.publish_batch(messages, boards)
+                               for boards, messages in self._frame_messages(led_colors, only_changed)))
+
+    async def update_all(self, r: int, g: int, b: int):
+        """Awaitable set_all."""
+        await self.update_leds({led_num: (r, g, b) for led_num in self.get_led_numbers()})
+
+
+# Example Usage
+if __name__ == "__main__":
+    async def main():
+        controller = AsyncLEDController()
+        await controller.start()
+        await controller.connected(timeout=10)
+        controller.set_board("main", send_to_all=True)
+
+        await controller.update_all(0, 0, 255)
+        await asyncio.sleep(1)
+        await controller.update_all(0, 0, 0)
+        await controller.stop()
+
+    asyncio.run(main())
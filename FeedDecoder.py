@@ -0,0 +1,209 @@
+import re
+from typing import Iterable, List, Optional, Tuple, Union
+
+from google.transit import gtfs_realtime_pb2
+
+
+# Protobuf wire types
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+# Field numbers in FeedMessage / FeedEntity / VehiclePosition / TripDescriptor
+FEED_HEADER = 1
+FEED_ENTITY = 2
+ENTITY_ID = 1
+ENTITY_VEHICLE = 4
+VEHICLE_TRIP = 1
+TRIP_ROUTE_ID = 5
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+        if shift > 63:
+            raise ValueError("Varint too long")
+
+
+def _skip_field(data: bytes, pos: int, wire_type: int) -> int:
+    if wire_type == VARINT:
+        return _read_varint(data, pos)[1]
+    if wire_type == FIXED64:
+        return pos + 8
+    if wire_type == LENGTH_DELIMITED:
+        length, pos = _read_varint(data, pos)
+        return pos + length
+    if wire_type == FIXED32:
+        return pos + 4
+    raise ValueError(f"Unsupported wire type {wire_type}")
+
+
+def _find_field(data: bytes, start: int, end: int, field: int) -> Optional[Tuple[int, int]]:
+    """(start, end) of the first length-delimited field in data[start:end], or None."""
+    wanted = (field << 3) | LENGTH_DELIMITED
+    pos = start
+    while pos < end:
+        key, pos = _read_varint(data, pos)
+        if key == wanted:
+            length, pos = _read_varint(data, pos)
+            if pos + length > end:
+                raise ValueError("Truncated feed")
+            return pos, pos + length
+        pos = _skip_field(data, pos, key & 0x07)
+    return None
+
+
+def _entity_id(data: bytes, start: int, end: int) -> str:
+    """Read FeedEntity.id from an entity's bytes without decoding the rest."""
+    span = _find_field(data, start, end, ENTITY_ID)
+    return data[span[0]:span[1]].decode() if span else ''
+
+
+def _route_id(data: bytes, start: int, end: int) -> bytes:
+    """Read FeedEntity.vehicle.trip.route_id from an entity's bytes, b'' if absent."""
+    span = (start, end)
+    for field in (ENTITY_VEHICLE, VEHICLE_TRIP, TRIP_ROUTE_ID):
+        span = _find_field(data, span[0], span[1], field)
+        if span is None:
+            return b''
+    return data[span[0]:span[1]]
+
+
+def decode_feed(data: bytes, route_prefixes: Union[str, Iterable[str]], keep_ids: Iterable[str] = ()):
+    """
+    Decode only the interesting parts of a GTFS-realtime FeedMessage.
+
+    The top level is scanned entity by entity on the wire. An entity is fully decoded only
+    if its vehicle.trip.route_id starts with one of route_prefixes, or if its id is in keep_ids
+    (so DIFFERENTIAL deletions of tracked vehicles are not missed). Everything else is skipped
+    without being parsed. A byte search for the prefixes rejects most entities cheaply; only
+    entities containing one are walked on the wire down to their route_id. Returns (FeedHeader, [FeedEntity, ...]); raises ValueError or
+    DecodeError on malformed input.
+    """
+    if isinstance(route_prefixes, str):
+        route_prefixes = (route_prefixes,)
+    prefixes = tuple(prefix.encode() for prefix in route_prefixes)
+    search = re.compile(b'|'.join(re.escape(prefix) for prefix in prefixes)).search
+    keep_ids = set(keep_ids)
+    header = gtfs_realtime_pb2.FeedHeader()
+    entities: List = []
+    end = len(data)
+    pos = 0
+
+    entity_key = (FEED_ENTITY << 3) | LENGTH_DELIMITED
+    header_key = (FEED_HEADER << 3) | LENGTH_DELIMITED
+
+    while pos < end:
+        key = data[pos]
+        if key != entity_key and key != header_key:
+            key, pos = _read_varint(data, pos)
+            pos = _skip_field(data, pos, key & 0x07)
+            continue
+        # Fast path for the common case of a one or two byte length
+        length = data[pos + 1]
+        if length < 0x80:
+            pos += 2
+        else:
+            length, pos = _read_varint(data, pos + 1)
+        entity_end = pos + length
+        if entity_end > end:
+            raise ValueError("Truncated feed")
+
+        if key == header_key:
+            header.MergeFromString(data[pos:entity_end])
+        elif ((search(data, pos, entity_end) and _route_id(data, pos, entity_end).startswith(prefixes))
+              or (keep_ids and _entity_id(data, pos, entity_end) in keep_ids)):
+            entities.append(gtfs_realtime_pb2.FeedEntity.FromString(data[pos:entity_end]))
+        pos = entity_end
+
+    return header, entities
+
+
+def synthetic_feed(num_buses=1000, num_trains=20, seed=0) -> bytes:
+    """A full-network style feed: many bus vehicles and a few rail vehicles."""
+    import random
+
+    rng = random.Random(seed)
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = '2.0'
+    feed.header.timestamp = 1700000000
+    for i in range(num_buses + num_trains):
+        is_train = i >= num_buses
+        entity = feed.entity.add()
+        entity.id = f"{i}"
+        vehicle = entity.vehicle
+        vehicle.trip.trip_id = f"{'RAIL' if is_train else 'BUS'}-{i}-{'EAST' if i % 2 else 'WEST'}"
+        vehicle.trip.route_id = 'RAIL' if is_train else str(rng.randint(0, 200))
+        vehicle.trip.start_date = '20241220'
+        vehicle.vehicle.id = f"{'T' if is_train else 'B'}{i}"
+        vehicle.vehicle.label = vehicle.vehicle.id
+        vehicle.position.latitude = 33.4 + rng.random() * 0.2
+        vehicle.position.longitude = -112.2 + rng.random() * 0.4
+        vehicle.position.bearing = rng.random() * 360
+        vehicle.position.speed = rng.random() * 20
+        vehicle.timestamp = 1700000000 + rng.randint(0, 60)
+        vehicle.stop_id = str(rng.randint(1000, 9999))
+        vehicle.current_stop_sequence = rng.randint(1, 60)
+    return feed.SerializeToString()
+
+
+# Benchmark: full ParseFromString + filter vs. selective decoding
+if __name__ == "__main__":
+    import argparse
+    import time
+    import tracemalloc
+
+    parser = argparse.ArgumentParser(description="Benchmark selective GTFS-realtime decoding")
+    parser.add_argument("--feed", help="Recorded feed file (default: synthetic)")
+    parser.add_argument("--buses", default="250,1000,4000", help="Synthetic bus counts")
+    parser.add_argument("--trains", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    # Both return (entities materialized as messages, matching entities)
+    def full_parse(data):
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(data)
+        return len(feed.entity), [entity for entity in feed.entity
+                                  if entity.HasField('vehicle') and entity.vehicle.trip.route_id.startswith('RAIL')]
+
+    def selective(data):
+        _, entities = decode_feed(data, 'RAIL')
+        return len(entities), [entity for entity in entities
+                               if entity.HasField('vehicle') and entity.vehicle.trip.route_id.startswith('RAIL')]
+
+    def measure(fn, data):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            result = fn(data)
+        elapsed = (time.perf_counter() - start) / args.repeat
+        # tracemalloc sees Python objects only; the C parser's arena scales with "decoded"
+        tracemalloc.start()
+        fn(data)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        decoded, matched = result
+        return elapsed, peak, decoded, len(matched)
+
+    feeds = []
+    if args.feed:
+        with open(args.feed, 'rb') as f:
+            feeds.append(("recorded", f.read()))
+    else:
+        for buses in [int(n) for n in args.buses.split(',')]:
+            feeds.append((f"{buses} buses + {args.trains} trains", synthetic_feed(buses, args.trains)))
+
+    print(f"{'feed':<28} {'KB':>7} {'path':<10} {'ms/parse':>9} {'py peak KB':>11} {'decoded':>8} {'matched':>8}")
+    for name, data in feeds:
+        for label, fn in (("full", full_parse), ("selective", selective)):
+            elapsed, peak, decoded, matched = measure(fn, data)
+            print(f"{name:<28} {len(data) / 1024:>7.0f} {label:<10} {elapsed * 1000:>9.2f} "
+                  f"{peak / 1024:>11.0f} {decoded:>8} {matched:>8}")
@@ -0,0 +1,350 @@
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Optional, Set, Tuple
+
+from aiohttp import web, WSMsgType
+
+
+# Direction codes sent to the browser
+DIRECTION_CODES = {'eastbound': 'e', 'westbound': 'w'}
+
+
+class _Frame:
+    """One serialized update, shared by every viewer: text for WebSockets, an event for SSE."""
+
+    def __init__(self, seq: int, text: str):
+        self.seq = seq
+        self.text = text
+        self.sse = b"data: " + text.encode() + b"\n\n"
+
+
+class _Viewer:
+    """A connected browser fed from a bounded queue, so a slow one never holds up the rest."""
+
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.resyncs = 0
+
+
+class LiveMapServer:
+    """
+    Web map of the trains for lobby screens and dashboards.
+
+    Serves live_map.html and streams updates over a WebSocket (/ws) or Server-Sent Events
+    (/events). publish() is called once per fetch cycle with the tracker: it diffs the
+    trains against the previous cycle and serializes a single delta (changed trains with
+    quantized coordinates, removed train IDs) that is queued to every viewer as is.
+    A new viewer first gets a snapshot of all trains; a viewer that falls queue_size
+    messages behind has its backlog replaced by a fresh snapshot.
+
+    Message format (JSON):
+        {"type": "snapshot"|"delta", "seq": int, "time": epoch s of the feed data,
+         "scale": coordinate scale, "trains": [[train_id, lat, lon, direction, LED_ID], ...],
+         "removed": [train_id, ...]}
+    lat/lon are integers in 1/scale degrees, direction is 'e', 'w' or 'u'.
+    """
+
+    def __init__(self, host="0.0.0.0", port=8080, precision=4, queue_size=8, page="live_map.html"):
+        self.host = host
+        self.port = port  # 0 picks a free port; read .port after start()
+        self.scale = 10 ** precision  # 4 decimal places is ~11 m
+        self.queue_size = queue_size
+        self.page = page
+        self.sse_keepalive = 30  # Seconds between SSE comments so proxies keep the stream open
+
+        self.trains: Dict[str, Tuple] = {}  # train_id -> (lat, lon, direction, LED_ID), quantized
+        self.seq = 0
+        self.feed_time = None
+        self.viewers: Set[_Viewer] = set()
+        self._snapshot: Optional[_Frame] = None
+        self._page_body = b''
+        self._stations_body = b'[]'
+        self._runner: Optional[web.AppRunner] = None
+
+        self.deltas_sent = 0
+        self.delta_bytes = 0
+        self.snapshots_built = 0
+
+    async def start(self, tracker=None):
+        """Start serving; the tracker's station table is sent to the page once."""
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), self.page), 'rb') as f:
+            self._page_body = f.read()
+        if tracker is not None:
+            stations = tracker.stations_df
+            self._stations_body = json.dumps([
+                [int(led_id), name, round(lat, 6), round(lon, 6)]
+                for led_id, name, lat, lon in zip(stations['LED_ID'], stations['StationName'],
+                                                  stations['POINT_Y'], stations['POINT_X'])
+            ], separators=(',', ':')).encode()
+
+        app = web.Application()
+        app.router.add_get('/', self._handle_page)
+        app.router.add_get('/stations.json', self._handle_stations)
+        app.router.add_get('/ws', self._handle_websocket)
+        app.router.add_get('/events', self._handle_events)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, self.host, self.port).start()
+        except OSError:
+            # E.g. the port is taken: leave nothing half started, the caller decides what to do
+            await self._runner.cleanup()
+            self._runner = None
+            raise
+        self.port = self._runner.addresses[0][1]
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            for viewer in list(self.viewers):
+                self._offer(viewer, None)  # Ends the viewer's stream
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _quantize(self, train, state) -> Tuple:
+        return (
+            round(train['lat'] * self.scale),
+            round(train['lon'] * self.scale),
+            DIRECTION_CODES.get(train['direction'], 'u'),
+            state.get('LED_ID') if state else None,
+        )
+
+    def _serialize(self, message_type: str, trains, removed=()) -> _Frame:
+        return _Frame(self.seq, json.dumps({
+            'type': message_type,
+            'seq': self.seq,
+            'time': self.feed_time,
+            'scale': self.scale,
+            'trains': [[train_id, *values] for train_id, values in trains],
+            'removed': list(removed),
+        }, separators=(',', ':')))
+
+    def publish(self, tracker):
+        """
+        Send the changes since the last cycle to every viewer (nothing if neither the trains
+        nor the feed time changed). Returns the number of changed and removed trains.
+        """
+        current = {}
+        for train in tracker.train_locations:
+            current[train['train_id']] = self._quantize(train, tracker.train_states.get(train['train_id']))
+        changed = [(train_id, values) for train_id, values in current.items() if self.trains.get(train_id) != values]
+        removed = [train_id for train_id in self.trains if train_id not in current]
+        if not changed and not removed and tracker.last_good_time == self.feed_time:
+            return 0
+
+        self.trains = current
+        self.feed_time = tracker.last_good_time
+        self.seq += 1
+        self._snapshot = None
+        frame = self._serialize('delta', changed, removed)
+        self.deltas_sent += 1
+        self.delta_bytes += len(frame.text)
+        for viewer in self.viewers:
+            self._offer(viewer, frame)
+        return len(changed) + len(removed)
+
+    def _snapshot_frame(self) -> _Frame:
+        """Every train as of the current seq, built at most once per cycle."""
+        if self._snapshot is None:
+            self._snapshot = self._serialize('snapshot', self.trains.items())
+            self.snapshots_built += 1
+        return self._snapshot
+
+    def _offer(self, viewer: _Viewer, frame: Optional[_Frame]):
+        try:
+            viewer.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # The snapshot supersedes everything queued, so a slow viewer catches up in one message
+            while not viewer.queue.empty():
+                viewer.queue.get_nowait()
+            viewer.queue.put_nowait(self._snapshot_frame() if frame is not None else None)
+            viewer.resyncs += 1
+
+    def _add_viewer(self) -> _Viewer:
+        viewer = _Viewer(self.queue_size)
+        viewer.queue.put_nowait(self._snapshot_frame())
+        self.viewers.add(viewer)
+        return viewer
+
+    async def _handle_page(self, request):
+        return web.Response(body=self._page_body, content_type='text/html')
+
+    async def _handle_stations(self, request):
+        return web.Response(body=self._stations_body, content_type='application/json')
+
+    async def _handle_websocket(self, request):
+        # No per-message deflate: it would compress the shared frame again for every viewer
+        ws = web.WebSocketResponse(heartbeat=30, compress=False)
+        await ws.prepare(request)
+        viewer = self._add_viewer()
+
+        async def send_frames():
+            while True:
+                frame = await viewer.queue.get()
+                if frame is None:
+                    await ws.close()
+                    return
+                await ws.send_str(frame.text)
+
+        sender = asyncio.ensure_future(send_frames())
+        try:
+            async for message in ws:  # Viewers only listen; this returns when they leave
+                if message.type == WSMsgType.ERROR:
+                    break
+        finally:
+            self.viewers.discard(viewer)
+            sender.cancel()
+        return ws
+
+    async def _handle_events(self, request):
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',  # Don't let nginx buffer the stream
+        })
+        await response.prepare(request)
+        viewer = self._add_viewer()
+        try:
+            while True:
+                try:
+                    frame = await asyncio.wait_for(viewer.queue.get(), self.sse_keepalive)
+                except asyncio.TimeoutError:
+                    await response.write(b": keepalive\n\n")
+                    continue
+                if frame is None:
+                    break
+                await response.write(frame.sse)
+        except ConnectionResetError:
+            pass
+        finally:
+            self.viewers.discard(viewer)
+        return response
+
+    def get_stats(self) -> Dict:
+        """Viewer count, delta sizes and how often viewers had to be resynced."""
+        return {
+            'viewers': len(self.viewers),
+            'trains': len(self.trains),
+            'seq': self.seq,
+            'deltas_sent': self.deltas_sent,
+            'mean_delta_bytes': self.delta_bytes / self.deltas_sent if self.deltas_sent else 0,
+            'snapshot_bytes': len(self._snapshot_frame().text),
+            'snapshots_built': self.snapshots_built,
+            'resyncs': sum(viewer.resyncs for viewer in self.viewers),
+        }
+
+
+# Benchmark: many WebSocket viewers on one server, fed a moving synthetic fleet
+if __name__ == "__main__":
+    import argparse
+    import random
+
+    import aiohttp
+
+    from ValleyMetroTracker import ValleyMetroTracker
+    from load_test import current_rss_mb, percentile
+
+    parser = argparse.ArgumentParser(description="Benchmark the live map fan-out to many viewers")
+    parser.add_argument("--viewers", default="50,200,500", help="Comma-separated viewer counts")
+    parser.add_argument("--cycles", type=int, default=20, help="Publish cycles per run")
+    parser.add_argument("--interval", type=float, default=0.5, help="Seconds between cycles")
+    parser.add_argument("--trains", type=int, default=40)
+    parser.add_argument("--moving", type=float, default=0.5, help="Fraction of trains that move each cycle")
+    parser.add_argument("--sse", type=float, default=0.0, help="Fraction of viewers using /events")
+    args = parser.parse_args()
+
+    tracker = ValleyMetroTracker('stations.csv', None)
+    rng = random.Random(0)
+    stations = tracker.stations_df
+    tracker.train_locations = [{
+        'train_id': f"{100 + i}",
+        'lat': stations['POINT_Y'].iloc[i % len(stations)],
+        'lon': stations['POINT_X'].iloc[i % len(stations)],
+        'direction': 'eastbound' if i % 2 else 'westbound',
+    } for i in range(args.trains)]
+
+    def move_trains():
+        for train in rng.sample(tracker.train_locations, int(len(tracker.train_locations) * args.moving)):
+            train['lat'] += rng.uniform(-0.002, 0.002)
+            train['lon'] += rng.uniform(-0.002, 0.002)
+        tracker.last_good_time = time.time()
+        tracker.update_train_states()
+
+    async def run(num_viewers):
+        server = await LiveMapServer(host='127.0.0.1', port=0).start(tracker)
+        base = f"http://127.0.0.1:{server.port}"
+        published = {}  # seq -> perf_counter() at publish
+        latencies, received_bytes = [], [0]
+
+        async def websocket_viewer(session, ready):
+            async with session.ws_connect(f"{base}/ws") as ws:
+                ready.set()
+                async for message in ws:
+                    received_bytes[0] += len(message.data)
+                    update = json.loads(message.data)
+                    if update['type'] == 'delta':
+                        latencies.append(time.perf_counter() - published[update['seq']])
+
+        async def sse_viewer(session, ready):
+            async with session.get(f"{base}/events") as response:
+                ready.set()
+                async for line in response.content:
+                    if line.startswith(b"data: "):
+                        received_bytes[0] += len(line)
+                        update = json.loads(line[6:])
+                        if update['type'] == 'delta':
+                            latencies.append(time.perf_counter() - published[update['seq']])
+
+        move_trains()
+        server.publish(tracker)
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            tasks = []
+            for i in range(num_viewers):
+                ready = asyncio.Event()
+                viewer = sse_viewer if i < num_viewers * args.sse else websocket_viewer
+                tasks.append(asyncio.ensure_future(viewer(session, ready)))
+                await ready.wait()
+            await asyncio.sleep(0.5)
+            received_bytes[0] = 0
+
+            publish_times = []
+            for _ in range(args.cycles):
+                move_trains()
+                start = time.perf_counter()
+                published[server.seq + 1] = start
+                server.publish(tracker)
+                publish_times.append(time.perf_counter() - start)
+                await asyncio.sleep(args.interval)
+
+            stats = server.get_stats()
+            rss = current_rss_mb()
+            await server.stop()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        return {
+            'viewers': num_viewers,
+            'publish_ms': sum(publish_times) / len(publish_times) * 1000,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'delivered': len(latencies) / (num_viewers * args.cycles),
+            'delta_bytes': stats['mean_delta_bytes'],
+            'snapshot_bytes': stats['snapshot_bytes'],
+            'kb_per_viewer': received_bytes[0] / num_viewers / args.cycles / 1024,
+            'resyncs': stats['resyncs'],
+            'rss_mb': rss,
+        }
+
+    async def main():
+        print(f"{args.trains} trains, {args.moving:.0%} moving per cycle, {args.cycles} cycles every {args.interval}s")
+        print(f"{'viewers':>8} {'publish ms':>11} {'fan-out p50':>12} {'p95 ms':>8} {'delivered':>10} "
+              f"{'delta B':>8} {'snapshot B':>11} {'KB/viewer/cycle':>16} {'resyncs':>8} {'RSS MB':>7}")
+        for num_viewers in [int(n) for n in args.viewers.split(',')]:
+            r = await run(num_viewers)
+            print(f"{r['viewers']:>8} {r['publish_ms']:>11.2f} {r['p50_ms']:>12.1f} {r['p95_ms']:>8.1f} "
+                  f"{r['delivered']:>10.0%} {r['delta_bytes']:>8.0f} {r['snapshot_bytes']:>11} "
+                  f"{r['kb_per_viewer']:>16.2f} {r['resyncs']:>8} {r['rss_mb']:>7.1f}")
+
+    asyncio.run(main())
@@ -0,0 +1,343 @@
+import asyncio
+import struct
+import time
+from typing import Dict, Optional, Set
+
+
+# MQTT control packet types
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def encode_remaining_length(length: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        out.append(byte)
+        if not length:
+            return bytes(out)
+
+
+def decode_varint(data: bytes, pos: int):
+    """Decode an MQTT variable byte integer, returning (value, new_pos)."""
+    value = 0
+    multiplier = 1
+    while True:
+        byte = data[pos]
+        pos += 1
+        value += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            return value, pos
+        multiplier *= 128
+
+
+def encode_string(value: str) -> bytes:
+    raw = value.encode()
+    return struct.pack('!H', len(raw)) + raw
+
+
+def decode_string(data: bytes, pos: int):
+    length = struct.unpack_from('!H', data, pos)[0]
+    pos += 2
+    return data[pos:pos + length].decode(), pos + length
+
+
+def packet(packet_type: int, body: bytes, flags: int = 0) -> bytes:
+    return bytes([(packet_type << 4) | flags]) + encode_remaining_length(len(body)) + body
+
+
+def publish_packet(topic: str, payload: bytes, protocol_level: int = 4) -> bytes:
+    """Build a QoS 0 PUBLISH packet for MQTT 3.1.1 (level 4) or 5 (level 5)."""
+    properties = b'\x00' if protocol_level >= 5 else b''
+    return packet(PUBLISH, encode_string(topic) + properties + payload)
+
+
+async def read_packet(reader: asyncio.StreamReader):
+    """Read one packet, returning (packet_type, flags, body)."""
+    header = await reader.readexactly(1)
+    length = 0
+    multiplier = 1
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+    body = await reader.readexactly(length) if length else b''
+    return header[0] >> 4, header[0] & 0x0F, body
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    filter_parts = topic_filter.split('/')
+    topic_parts = topic.split('/')
+    for i, part in enumerate(filter_parts):
+        if part == '#':
+            return True
+        if i >= len(topic_parts):
+            return False
+        if part != '+' and part != topic_parts[i]:
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+
+class _Session:
+    def __init__(self, broker, reader, writer):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.client_id = None
+        self.protocol_level = 4
+        self.filters: Set[str] = set()
+        self.next_publish = 0.0  # Earliest time the next PUBLISH is accepted when rate limited
+
+    def send(self, data: bytes):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+    async def run(self):
+        try:
+            while True:
+                packet_type, flags, body = await read_packet(self.reader)
+                if packet_type == CONNECT:
+                    self._on_connect(body)
+                elif packet_type == PUBLISH:
+                    if self.broker.publish_rate_limit:
+                        await self._throttle()
+                    self._on_publish(flags, body)
+                elif packet_type == SUBSCRIBE:
+                    self._on_subscribe(body)
+                elif packet_type == UNSUBSCRIBE:
+                    self._on_unsubscribe(body)
+                elif packet_type == PINGREQ:
+                    self.send(packet(PINGRESP, b''))
+                elif packet_type == DISCONNECT:
+                    break
+                # Flow control: don't let a slow reader make the broker buffer without bound
+                await self.writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.broker._remove_session(self)
+            self.writer.close()
+
+    async def _throttle(self):
+        """Pace this connection's publishes to the broker's per-connection limit."""
+        interval = 1.0 / self.broker.publish_rate_limit
+        now = time.monotonic()
+        start = max(self.next_publish, now)
+        self.next_publish = start + interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def _skip_properties(self, body: bytes, pos: int) -> int:
+        if self.protocol_level >= 5:
+            length, pos = decode_varint(body, pos)
+            pos += length
+        return pos
+
+    def _on_connect(self, body: bytes):
+        _, pos = decode_string(body, 0)  # Protocol name
+        self.protocol_level = body[pos]
+        pos += 4  # Level, connect flags, keep alive
+        pos = self._skip_properties(body, pos)
+        self.client_id, pos = decode_string(body, pos)
+        if self.protocol_level >= 5:
+            self.send(packet(CONNACK, b'\x00\x00\x00'))
+        else:
+            self.send(packet(CONNACK, b'\x00\x00'))
+
+    def _on_publish(self, flags: int, body: bytes):
+        qos = (flags >> 1) & 0x03
+        topic, pos = decode_string(body, 0)
+        if qos:
+            packet_id = body[pos:pos + 2]
+            pos += 2
+            self.send(packet(PUBACK, packet_id))
+        pos = self._skip_properties(body, pos)
+        self.broker.route(topic, body[pos:])
+
+    def _on_subscribe(self, body: bytes):
+        packet_id = body[:2]
+        pos = self._skip_properties(body, 2)
+        granted = bytearray()
+        while pos < len(body):
+            topic_filter, pos = decode_string(body, pos)
+            pos += 1  # Subscription options
+            self.broker._add_subscription(self, topic_filter)
+            granted.append(0)
+        properties = b'\x00' if self.protocol_level >= 5 else b''
+        self.send(packet(SUBACK, packet_id + properties + bytes(granted), flags=0))
+
+    def _on_unsubscribe(self, body: bytes):
+        packet_id = body[:2]
+        pos = self._skip_properties(body, 2)
+        codes = bytearray()
+        while pos < len(body):
+            topic_filter, pos = decode_string(body, pos)
+            self.broker._remove_subscription(self, topic_filter)
+            codes.append(0)
+        if self.protocol_level >= 5:
+            self.send(packet(UNSUBACK, packet_id + b'\x00' + bytes(codes)))
+        else:
+            self.send(packet(UNSUBACK, packet_id))
+
+
+class LocalBroker:
+    """
+    Minimal in-process MQTT broker for local testing (QoS 0/1 in, QoS 0 out, no retain or will).
+    Speaks MQTT 3.1.1 and 5 so both paho (SimpleLEDController) and firmware-style clients can connect.
+    publish_rate_limit caps the messages/s each connection may publish, like the per-connection
+    limits of hosted brokers (AWS IoT Core allows 100/s); None is unlimited.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, publish_rate_limit=None):
+        self.host = host
+        self.port = port  # 0 picks a free port; read .port after start()
+        self.publish_rate_limit = publish_rate_limit
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.sessions: Set[_Session] = set()
+        self._session_tasks: Set[asyncio.Task] = set()
+        self.exact_subscriptions: Dict[str, Set[_Session]] = {}
+        self.wildcard_subscriptions: Dict[str, Set[_Session]] = {}
+        self.messages_in = 0
+        self.messages_out = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            for session in list(self.sessions):
+                session.writer.close()
+            await asyncio.gather(*self._session_tasks, return_exceptions=True)
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle_client(self, reader, writer):
+        session = _Session(self, reader, writer)
+        self.sessions.add(session)
+        task = asyncio.current_task()
+        self._session_tasks.add(task)
+        try:
+            await session.run()
+        finally:
+            self._session_tasks.discard(task)
+
+    def _add_subscription(self, session: _Session, topic_filter: str):
+        table = self.wildcard_subscriptions if ('+' in topic_filter or '#' in topic_filter) \
+            else self.exact_subscriptions
+        table.setdefault(topic_filter, set()).add(session)
+        session.filters.add(topic_filter)
+
+    def _remove_subscription(self, session: _Session, topic_filter: str):
+        for table in (self.exact_subscriptions, self.wildcard_subscriptions):
+            subscribers = table.get(topic_filter)
+            if subscribers is not None:
+                subscribers.discard(session)
+                if not subscribers:
+                    del table[topic_filter]
+        session.filters.discard(topic_filter)
+
+    def _remove_session(self, session: _Session):
+        for topic_filter in list(session.filters):
+            self._remove_subscription(session, topic_filter)
+        self.sessions.discard(session)
+
+    def route(self, topic: str, payload: bytes):
+        """Deliver a message to every session with a matching subscription (once per session)."""
+        self.messages_in += 1
+        targets = set(self.exact_subscriptions.get(topic, ()))
+        for topic_filter, subscribers in self.wildcard_subscriptions.items():
+            if topic_matches(topic_filter, topic):
+                targets |= subscribers
+
+        encoded = {}
+        for session in targets:
+            data = encoded.get(session.protocol_level)
+            if data is None:
+                data = encoded[session.protocol_level] = publish_packet(topic, payload, session.protocol_level)
+            session.send(data)
+            self.messages_out += 1
+
+
+class MiniMQTTClient:
+    """
+    Small asyncio MQTT 3.1.1 client (QoS 0), enough to emulate a PubSubClient-based board.
+    """
+
+    def __init__(self, client_id: str, on_message=None, keepalive: int = 60):
+        self.client_id = client_id
+        self.on_message = on_message  # Called as on_message(topic, payload)
+        self.keepalive = keepalive
+        self.reader = None
+        self.writer = None
+        self._packet_id = 0
+        self._connected = asyncio.Event()
+        self._read_task = None
+
+    async def connect(self, host: str, port: int):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        body = (encode_string('MQTT') + bytes([4, 0x02]) + struct.pack('!H', self.keepalive)
+                + encode_string(self.client_id))
+        self.writer.write(packet(CONNECT, body))
+        await self.writer.drain()
+        self._read_task = asyncio.ensure_future(self._read_loop())
+        await self._connected.wait()
+
+    async def _read_loop(self):
+        try:
+            while True:
+                packet_type, flags, body = await read_packet(self.reader)
+                if packet_type == CONNACK:
+                    self._connected.set()
+                elif packet_type == PUBLISH:
+                    topic, pos = decode_string(body, 0)
+                    if (flags >> 1) & 0x03:
+                        pos += 2
+                    if self.on_message is not None:
+                        self.on_message(topic, body[pos:])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    def subscribe(self, topic_filter: str):
+        self._packet_id = self._packet_id % 0xFFFF + 1
+        body = struct.pack('!H', self._packet_id) + encode_string(topic_filter) + b'\x00'
+        self.writer.write(packet(SUBSCRIBE, body, flags=0x02))
+
+    def publish(self, topic: str, payload: bytes):
+        self.writer.write(publish_packet(topic, payload))
+
+    async def disconnect(self):
+        if self.writer is not None and not self.writer.is_closing():
+            self.writer.write(packet(DISCONNECT, b''))
+            self.writer.close()
+        if self._read_task is not None:
+            self._read_task.cancel()
+
+
+# Example Usage
+if __name__ == "__main__":
+    import sys
+
+    async def main():
+        port = int(sys.argv[1]) if len(sys.argv) > 1 else 1883
+        broker = await LocalBroker("0.0.0.0", port).start()
+        print(f"Local MQTT broker listening on port {broker.port}")
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
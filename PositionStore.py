@@ -0,0 +1,227 @@
+import os
+import time
+from datetime import datetime, date, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+# One fixed-size record per observed train position
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'),    # Vehicle timestamp, epoch seconds
+    ('train_id', 'S16'),
+    ('trip_id', 'S32'),
+    ('lat', '<f4'),
+    ('lon', '<f4'),
+    ('LED_ID', '<i2'),       # Assigned (closest) station, -1 if none
+    ('distance_km', '<f4'),  # Distance to the assigned station
+    ('direction', 'i1'),     # Index into DIRECTIONS
+])
+
+DIRECTIONS = ['eastbound', 'westbound', 'unknown']
+
+
+class PositionStore:
+    """
+    Append-only store of train positions, partitioned into one binary file per day.
+    Rows are buffered in memory and written in bulk; a day loads with a single np.fromfile.
+    """
+
+    def __init__(self, root_dir="history", flush_rows=2000, flush_interval=300):
+        self.root_dir = root_dir
+        self.flush_rows = flush_rows  # Flush when this many rows are buffered
+        self.flush_interval = flush_interval  # ... or when the oldest buffered row is this old (seconds)
+        self._buffer: List[tuple] = []
+        self._buffer_started = None
+        self._last_timestamps: Dict[str, float] = {}  # train_id -> last recorded vehicle timestamp
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def _partition_path(self, day: date) -> str:
+        return os.path.join(self.root_dir, f"positions-{day.isoformat()}.bin")
+
+    def record(self, trains: List[Dict], states: Dict[str, Dict]):
+        """
+        Buffer one fetch worth of trains.
+        trains: tracker train_locations; states: tracker train_states (assigned station per train).
+        Positions whose vehicle timestamp did not advance since the last record are skipped.
+        """
+        for train in trains:
+            train_id = train['train_id']
+            timestamp = train['timestamp'].timestamp()
+            if self._last_timestamps.get(train_id) == timestamp:
+                continue
+            self._last_timestamps[train_id] = timestamp
+
+            state = states.get(train_id, {})
+            led_id = state.get('LED_ID')
+            self._buffer.append((
+                timestamp,
+                train_id.encode()[:16],
+                train.get('trip_id', '').encode()[:32],
+                train['lat'],
+                train['lon'],
+                -1 if led_id is None else led_id,
+                state.get('distance_km', np.nan),
+                DIRECTIONS.index(train['direction']) if train['direction'] in DIRECTIONS else 2,
+            ))
+
+        # Forget trains that are no longer reporting
+        current = {train['train_id'] for train in trains}
+        for train_id in [train_id for train_id in self._last_timestamps if train_id not in current]:
+            del self._last_timestamps[train_id]
+
+        if self._buffer and self._buffer_started is None:
+            self._buffer_started = time.time()
+        if len(self._buffer) >= self.flush_rows or (
+                self._buffer_started is not None and time.time() - self._buffer_started >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write buffered rows to their day partitions."""
+        if not self._buffer:
+            return
+        rows = np.array(self._buffer, dtype=RECORD_DTYPE)
+        self._buffer = []
+        self._buffer_started = None
+
+        days = np.array([datetime.fromtimestamp(ts).date() for ts in rows['timestamp']])
+        for day in np.unique(days):
+            with open(self._partition_path(day), 'ab') as f:
+                rows[days == day].tofile(f)
+
+    def load_raw(self, day: date) -> np.ndarray:
+        """Return a day's rows as a structured NumPy array."""
+        path = self._partition_path(day)
+        if not os.path.exists(path):
+            return np.empty(0, dtype=RECORD_DTYPE)
+        return np.fromfile(path, dtype=RECORD_DTYPE)
+
+    def load(self, start: date, end: Optional[date] = None) -> pd.DataFrame:
+        """
+        Load all rows from start through end (inclusive) as a DataFrame sorted by train and time.
+        Columns: timestamp (epoch s), train_id, trip_id, lat, lon, LED_ID, distance_km, direction
+        """
+        end = end or start
+        parts = []
+        day = start
+        while day <= end:
+            parts.append(self.load_raw(day))
+            day += timedelta(days=1)
+        rows = np.concatenate(parts) if parts else np.empty(0, dtype=RECORD_DTYPE)
+
+        df = pd.DataFrame({
+            'timestamp': rows['timestamp'],
+            'train_id': np.char.decode(rows['train_id']),
+            'trip_id': np.char.decode(rows['trip_id']),
+            'lat': rows['lat'],
+            'lon': rows['lon'],
+            'LED_ID': rows['LED_ID'],
+            'distance_km': rows['distance_km'],
+            'direction': pd.Categorical.from_codes(rows['direction'], DIRECTIONS),
+        })
+        return df.sort_values(['train_id', 'timestamp'], kind='stable').reset_index(drop=True)
+
+
+def station_visits(df: pd.DataFrame, radius_km: float = 0.15, max_gap: float = 180) -> pd.DataFrame:
+    """
+    Collapse position rows into station visits: consecutive rows of one train within
+    radius_km of the same station, with no gap longer than max_gap seconds.
+    df must be sorted by train_id then timestamp (as returned by PositionStore.load).
+    Columns: train_id, trip_id, LED_ID, direction, arrival, departure, dwell_s
+    """
+    near = df[(df['LED_ID'] >= 0) & (df['distance_km'] <= radius_km)]
+    if near.empty:
+        return pd.DataFrame(columns=['train_id', 'trip_id', 'LED_ID', 'direction', 'arrival', 'departure', 'dwell_s'])
+
+    train = near['train_id'].to_numpy()
+    led = near['LED_ID'].to_numpy()
+    ts = near['timestamp'].to_numpy()
+
+    new_visit = np.ones(len(near), dtype=bool)
+    new_visit[1:] = (train[1:] != train[:-1]) | (led[1:] != led[:-1]) | (np.diff(ts) > max_gap)
+    visit_id = np.cumsum(new_visit)
+
+    visits = near.groupby(visit_id, sort=False).agg(
+        train_id=('train_id', 'first'),
+        trip_id=('trip_id', 'first'),
+        LED_ID=('LED_ID', 'first'),
+        direction=('direction', 'first'),
+        arrival=('timestamp', 'min'),
+        departure=('timestamp', 'max'),
+    ).reset_index(drop=True)
+    visits['dwell_s'] = visits['departure'] - visits['arrival']
+    return visits
+
+
+def headways(visits: pd.DataFrame) -> pd.DataFrame:
+    """
+    Time between consecutive arrivals at each station in each direction.
+    Columns: LED_ID, direction, arrival, headway_s (NaN for the first arrival of each group)
+    """
+    ordered = visits.sort_values(['LED_ID', 'direction', 'arrival'], kind='stable')
+    led = ordered['LED_ID'].to_numpy()
+    direction = ordered['direction'].astype(str).to_numpy()
+    arrival = ordered['arrival'].to_numpy()
+
+    headway = np.full(len(ordered), np.nan)
+    if len(ordered) > 1:
+        same_group = (led[1:] == led[:-1]) & (direction[1:] == direction[:-1])
+        headway[1:] = np.where(same_group, np.diff(arrival), np.nan)
+
+    return pd.DataFrame({
+        'LED_ID': led,
+        'direction': direction,
+        'arrival': arrival,
+        'headway_s': headway,
+    })
+
+
+def headway_summary(visits: pd.DataFrame) -> pd.DataFrame:
+    """Median, p90 and count of headways per station and direction."""
+    h = headways(visits).dropna(subset=['headway_s'])
+    return h.groupby(['LED_ID', 'direction'], observed=True)['headway_s'].agg(
+        median='median', p90=lambda s: s.quantile(0.9), count='count').reset_index()
+
+
+def dwell_summary(visits: pd.DataFrame) -> pd.DataFrame:
+    """Median, p90 and count of dwell times per station and direction."""
+    return visits.groupby(['LED_ID', 'direction'], observed=True)['dwell_s'].agg(
+        median='median', p90=lambda s: s.quantile(0.9), count='count').reset_index()
+
+
+def trip_durations(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Duration of each observed trip from its first to its last position.
+    Columns: train_id, trip_id, direction, start, end, duration_s, first_LED_ID, last_LED_ID
+    """
+    trips = df[df['trip_id'] != ''].groupby(['train_id', 'trip_id'], sort=False).agg(
+        direction=('direction', 'first'),
+        start=('timestamp', 'min'),
+        end=('timestamp', 'max'),
+        first_LED_ID=('LED_ID', 'first'),
+        last_LED_ID=('LED_ID', 'last'),
+    ).reset_index()
+    trips['duration_s'] = trips['end'] - trips['start']
+    return trips
+
+
+# Example Usage
+if __name__ == "__main__":
+    import sys
+
+    store = PositionStore()
+    day = date.fromisoformat(sys.argv[1]) if len(sys.argv) > 1 else date.today()
+
+    start = time.perf_counter()
+    positions = store.load(day)
+    visits = station_visits(positions)
+    print(f"Loaded {len(positions)} positions, {len(visits)} station visits "
+          f"in {time.perf_counter() - start:.2f}s")
+
+    print("\nHeadways (seconds):")
+    print(headway_summary(visits).to_string(index=False))
+    print("\nDwell times (seconds):")
+    print(dwell_summary(visits).to_string(index=False))
+    print("\nTrip durations (seconds):")
+    print(trip_durations(positions)[['train_id', 'trip_id', 'direction', 'duration_s']].to_string(index=False))
@@ -0,0 +1,187 @@
+import cProfile
+import io
+import json
+import math
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+class Profiler:
+    """
+    On-demand profiling for the running tracker process.
+
+    Stage timers are always on (one perf_counter pair per stage). A capture, started by a
+    signal or an MQTT command, runs for a fixed duration and writes to output_dir:
+      - sample mode: a collapsed-stack file (<name>.folded) for flamegraph.pl / speedscope
+      - cprofile mode: a pstats file (<name>.prof) plus a text summary of the top functions
+    and in both modes the per-stage timings recorded during the capture (<name>.stages.json).
+    """
+
+    MODES = ("sample", "cprofile")
+
+    def __init__(self, output_dir="profiles", loop=None, default_duration=30, sample_interval=0.01,
+                 min_duration=1, max_duration=300):
+        self.output_dir = output_dir
+        self.loop = loop  # Event loop cProfile captures are enabled on (cProfile is per-thread)
+        self.default_duration = default_duration
+        # Captures can be requested over MQTT, so durations are clamped to this range (seconds)
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.sample_interval = sample_interval
+        self.stage_totals: Dict[str, List[float]] = {}  # name -> [count, total seconds, max seconds]
+        self._window: Optional[Dict[str, List[float]]] = None  # Stage durations during a capture
+        self._lock = threading.Lock()
+        self._capturing = False
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a block of work under a stage name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            totals = self.stage_totals.setdefault(name, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += elapsed
+            totals[2] = max(totals[2], elapsed)
+            window = self._window
+            if window is not None:
+                window.setdefault(name, []).append(elapsed)
+
+    def capture(self, duration: Optional[float] = None, mode: str = "sample") -> bool:
+        """
+        Start a capture of the given duration ('sample' or 'cprofile'). Safe to call from any thread.
+        The duration is clamped to [min_duration, max_duration]; a missing or invalid one uses
+        default_duration. Returns False for an unknown mode or if a capture is already running.
+        """
+        if mode not in self.MODES:
+            print(f"Profiler: unknown mode {mode!r}")
+            return False
+        try:
+            duration = float(duration) if duration is not None else self.default_duration
+        except (TypeError, ValueError):
+            duration = self.default_duration
+        if not math.isfinite(duration):
+            duration = self.default_duration
+        duration = min(max(duration, self.min_duration), self.max_duration)
+
+        with self._lock:
+            if self._capturing:
+                print("Profiler: capture already running")
+                return False
+            self._capturing = True
+
+        name = os.path.join(self.output_dir, f"{datetime.now():%Y%m%d-%H%M%S}-{mode}")
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+        except OSError as e:
+            print(f"Profiler: cannot create {self.output_dir}: {str(e)}")
+            self._finish(None)
+            return False
+        self._window = {}
+        print(f"Profiler: {mode} capture for {duration:g}s -> {name}.*")
+
+        if mode == "cprofile" and self.loop is not None:
+            self.loop.call_soon_threadsafe(self._start_cprofile, duration, name)
+        else:
+            if mode == "cprofile":
+                print("Profiler: no event loop for cprofile, sampling instead")
+            threading.Thread(target=self._sample, args=(duration, name), daemon=True).start()
+        return True
+
+    def _sample(self, duration: float, name: str):
+        try:
+            own_thread = threading.get_ident()
+            stacks = Counter()
+            end = time.monotonic() + duration
+            while time.monotonic() < end:
+                thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_thread:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    stack.append(thread_names.get(thread_id, str(thread_id)))
+                    stacks[';'.join(reversed(stack))] += 1
+                time.sleep(self.sample_interval)
+
+            with open(f"{name}.folded", 'w') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        finally:
+            self._finish(name)
+
+    def _start_cprofile(self, duration: float, name: str):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:  # Another profiler is active on this thread
+            print(f"Profiler: cannot start cProfile: {str(e)}")
+            self._finish(None)
+            return
+        self.loop.call_later(duration, self._stop_cprofile, profile, name)
+
+    def _stop_cprofile(self, profile: cProfile.Profile, name: str):
+        try:
+            profile.disable()
+            profile.dump_stats(f"{name}.prof")
+            summary = io.StringIO()
+            pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(30)
+            with open(f"{name}.txt", 'w') as f:
+                f.write(summary.getvalue())
+        finally:
+            self._finish(name)
+
+    def _finish(self, name: Optional[str]):
+        """Write the stage timings (if name is set) and allow the next capture, even on errors."""
+        window, self._window = self._window or {}, None
+        try:
+            if name is not None:
+                report = {
+                    'capture': {stage: self._summarize(durations) for stage, durations in window.items()},
+                    'lifetime': {
+                        stage: {'count': int(count), 'mean_ms': total / count * 1000 if count else 0.0,
+                                'max_ms': peak * 1000}
+                        for stage, (count, total, peak) in self.stage_totals.items()
+                    },
+                }
+                with open(f"{name}.stages.json", 'w') as f:
+                    json.dump(report, f, indent=2)
+                print(f"Profiler: capture written to {name}.*")
+        finally:
+            with self._lock:
+                self._capturing = False
+
+    @staticmethod
+    def _summarize(durations: List[float]) -> Dict[str, float]:
+        ordered = sorted(durations)
+        return {
+            'count': len(ordered),
+            'mean_ms': sum(ordered) / len(ordered) * 1000,
+            'p50_ms': ordered[len(ordered) // 2] * 1000,
+            'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+            'max_ms': ordered[-1] * 1000,
+        }
+
+    def install_signal_handlers(self):
+        """SIGUSR1 starts a sampling capture, SIGUSR2 a cProfile capture (default duration)."""
+        if not hasattr(signal, 'SIGUSR1'):
+            return
+        if self.loop is not None:
+            self.loop.add_signal_handler(signal.SIGUSR1, self.capture, None, "sample")
+            self.loop.add_signal_handler(signal.SIGUSR2, self.capture, None, "cprofile")
+        else:
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.capture(None, "sample"))
+            signal.signal(signal.SIGUSR2, lambda signum, frame: self.capture(None, "cprofile"))
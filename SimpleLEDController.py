@@ -1,38 +1,124 @@
 import paho.mqtt.client as mqtt
 import json
 import sqlite3
-from typing import Dict, List, Optional
+import hashlib
+from bisect import bisect
+from typing import Dict, List, Tuple
 from datetime import datetime, timedelta
 import threading
 import time
 
+
+def encode_message(message: Dict) -> str:
+    """Compact JSON, so more LEDs fit in each MQTT packet"""
+    return json.dumps(message, separators=(',', ':'))
+
+
+def chunk_leds_hex(leds_hex: List[tuple], max_payload: int, extra: Dict = None) -> List[Dict]:
+    """Pack (led_num, hex color) pairs into as few "leds_hex" messages as fit in max_payload
+    bytes each once encoded by encode_message. Every message also carries the fields in extra."""
+    extra = extra or {}
+    empty = len(encode_message({"leds_hex": [], **extra}))
+    messages = []
+    chunk, size = [], empty
+    for pair in leds_hex:
+        pair_size = len(encode_message(pair)) + 1  # With the separating comma
+        if chunk and size + pair_size > max_payload:
+            messages.append({"leds_hex": chunk, **extra})
+            chunk, size = [], empty
+        chunk.append(pair)
+        size += pair_size
+    if chunk:
+        messages.append({"leds_hex": chunk, **extra})
+    return messages
+
+
 class SimpleLEDController:
-    def __init__(self, broker_ip="test.mosquitto.org", broker_port=1883, db_path="led_boards.db"):
+    def __init__(self, broker_ip="test.mosquitto.org", broker_port=1883, db_path="led_boards.db", num_connections=1):
+        # Layout assumed for boards whose heartbeat does not advertise one (older firmware):
+        # 45 LEDs and PubSubClient's default 256 byte packet, minus the control topic
         self.num_leds = 45
-        self.chunk_size = 10
+        self.default_max_payload = 200
+        self.board_layouts = {}  # board_id -> {"led_count": int, "max_payload": int} from heartbeats
+        self._new_layouts = set()  # Boards that need a full frame: new, changed layout, rebooted or back from a timeout
+        self._board_uptimes = {}  # board_id -> uptime (ms) in its last heartbeat, to spot reboots
         self.current_board = None
         self.brightness = 50
         self.send_to_all = False
         self.active_boards = {}  # Dictionary to store board_id: last_seen
+        self.last_frames = {}  # board_id -> {led_num: hex color} last sent to the board
         self.timeout_seconds = 30
         self.db_path = db_path
+        self.history_rows_per_board = 2000  # heartbeat_history kept per board, ~2 days at one per 100 s
+        self._unpruned_boards = set()  # Boards with history rows written since the last prune
+        self.profiler = None  # Optional Profiler, started by messages on the profile topic
+        self.profile_topic = "xVC5!GVcWEh4CF/neopixels/server/profile"
 
         # Initialize database
         self._init_database()
 
-        # Initialize MQTT client
-        self.client = mqtt.Client(protocol=mqtt.MQTTv5)
+        # Initialize MQTT clients. Boards are spread over the pool by consistent hashing of
+        # board_id; only the first client subscribes, so each heartbeat is received once.
+        self.broker_ip = broker_ip
+        self.broker_port = broker_port
+        self.clients = [mqtt.Client(protocol=mqtt.MQTTv5) for _ in range(max(1, num_connections))]
+        self.client = self.clients[0]
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
+        self.publish_counts = [0] * len(self.clients)  # Publishes per connection
+        self._board_connections = {}  # board_id -> index into clients
+        self._build_ring()
 
         # Connect to broker
-        try:
-            self.client.connect(broker_ip, broker_port, 60)
-            self.client.loop_start()
-        except Exception as e:
-            print(f"Connection failed: {str(e)}")
-
-        # Start cleanup thread for inactive boards
+        self._connect()
+
+        # Start cleanup of inactive boards
+        self._start_cleanup()
+
+    def _connect(self):
+        """Connect every client to the broker, each with paho's network loop on its own thread"""
+        for client in self.clients:
+            try:
+                client.connect(self.broker_ip, self.broker_port, 60)
+                client.loop_start()
+            except Exception as e:
+                print(f"Connection failed: {str(e)}")
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+    def _build_ring(self, replicas: int = 160):
+        """Hash ring with several points per connection, so boards spread evenly and
+        resizing the pool only moves the boards of the added or removed connection"""
+        ring = sorted((self._hash(f"connection-{index}:{replica}"), index)
+                      for index in range(len(self.clients)) for replica in range(replicas))
+        self._ring_hashes = [point for point, _ in ring]
+        self._ring_connections = [index for _, index in ring]
+        self._board_connections.clear()
+
+    def _connection_for(self, board_id: str) -> int:
+        """Index of the client that publishes to a board"""
+        index = self._board_connections.get(board_id)
+        if index is None:
+            position = bisect(self._ring_hashes, self._hash(board_id)) % len(self._ring_hashes)
+            index = self._ring_connections[position]
+            self._board_connections[board_id] = index
+        return index
+
+    def get_connection_stats(self) -> List[Dict]:
+        """Boards mapped to and publishes sent by each connection"""
+        boards = [0] * len(self.clients)
+        for board_id in self._target_boards(quiet=True):
+            boards[self._connection_for(board_id)] += 1
+        return [
+            {"connection": index, "boards": boards[index], "publishes": self.publish_counts[index],
+             "connected": client.is_connected()}
+            for index, client in enumerate(self.clients)
+        ]
+
+    def _start_cleanup(self):
+        """Start cleanup thread for inactive boards"""
         self.cleanup_thread = threading.Thread(target=self._cleanup_inactive_boards, daemon=True)
         self.cleanup_thread.start()
 
@@ -59,6 +145,11 @@ class SimpleLEDController:
     def _update_board_heartbeat(self, board_id: str, status: str):
         """Update board heartbeat in database"""
         current_time = datetime.now()
+        self._write_heartbeat(board_id, status, current_time)
+        self.active_boards[board_id] = current_time
+
+    def _write_heartbeat(self, board_id: str, status: str, current_time: datetime):
+        """Record a heartbeat in board_heartbeats and heartbeat_history"""
         with sqlite3.connect(self.db_path) as conn:
             # Update current status
             conn.execute("""
@@ -70,7 +161,7 @@ class SimpleLEDController:
                 INSERT INTO heartbeat_history (board_id, status, timestamp)
                 VALUES (?, ?, ?)
             """, (board_id, status, current_time))
-        self.active_boards[board_id] = current_time
+        self._unpruned_boards.add(board_id)
 
     def get_active_boards(self) -> List[str]:
         """Returns list of currently active boards"""
@@ -82,18 +173,50 @@ class SimpleLEDController:
                 active.append(board_id)
         return active
 
+    def _mark_inactive_boards(self):
+        """Mark boards that missed their heartbeat as offline and prune their history"""
+        self._write_offline(self._expire_inactive_boards())
+        self._prune_history()
+
+    def _expire_inactive_boards(self) -> List[str]:
+        """Remove boards that missed their heartbeat from active_boards and return them"""
+        current_time = datetime.now()
+        expired = [board_id for board_id, last_seen in list(self.active_boards.items())
+                   if current_time - last_seen > timedelta(seconds=self.timeout_seconds)]
+        for board_id in expired:
+            del self.active_boards[board_id]
+        return expired
+
+    def _write_offline(self, board_ids: List[str]):
+        """Set the status of boards to offline in board_heartbeats"""
+        if not board_ids:
+            return
+        with sqlite3.connect(self.db_path) as conn:
+            conn.executemany("""
+                UPDATE board_heartbeats SET status = 'offline'
+                WHERE board_id = ?
+            """, [(board_id,) for board_id in board_ids])
+
+    def _prune_history(self):
+        """Keep only the newest history_rows_per_board heartbeat_history rows of each board
+        that sent a heartbeat since the last prune"""
+        boards, self._unpruned_boards = self._unpruned_boards, set()
+        if not boards:
+            return
+        with sqlite3.connect(self.db_path) as conn:
+            # The subquery is NULL (nothing deleted) while a board has fewer rows than the limit
+            conn.executemany("""
+                DELETE FROM heartbeat_history
+                WHERE board_id = ? AND timestamp < (
+                    SELECT timestamp FROM heartbeat_history WHERE board_id = ?
+                    ORDER BY timestamp DESC LIMIT 1 OFFSET ?
+                )
+            """, [(board_id, board_id, self.history_rows_per_board - 1) for board_id in sorted(boards)])
+
     def _cleanup_inactive_boards(self):
         """Periodically clean up inactive boards"""
         while True:
-            current_time = datetime.now()
-            with sqlite3.connect(self.db_path) as conn:
-                for board_id, last_seen in list(self.active_boards.items()):
-                    if current_time - last_seen > timedelta(seconds=self.timeout_seconds):
-                        conn.execute("""
-                            UPDATE board_heartbeats SET status = 'offline'
-                            WHERE board_id = ?
-                        """, (board_id,))
-                        del self.active_boards[board_id]
+            self._mark_inactive_boards()
             time.sleep(10)  # Check every 10 seconds
 
     def set_board(self, board_id: str, send_to_all: bool = False):
@@ -101,24 +224,78 @@ class SimpleLEDController:
         self.current_board = board_id
         self.send_to_all = send_to_all
 
-    def _publish_message(self, message: Dict):
-        """Publish message to MQTT broker"""
+    def _target_boards(self, quiet: bool = False) -> List[str]:
+        """Boards messages are currently sent to"""
         if self.send_to_all:
-            active_boards = self.get_active_boards()
-            for board_id in active_boards:
-                topic = f"xVC5!GVcWEh4CF/neopixels/{board_id}/control"
-                self.client.publish(topic, json.dumps(message))
+            return self.get_active_boards()
         elif self.current_board:
-            topic = f"xVC5!GVcWEh4CF/neopixels/{self.current_board}/control"
-            self.client.publish(topic, json.dumps(message))
-        else:
+            return [self.current_board]
+        if not quiet:
             print("No board selected!")
+        return []
+
+    def _publish_to_board(self, board_id: str, payload: str) -> mqtt.MQTTMessageInfo:
+        """Publish a payload to a board's control topic on the board's connection"""
+        index = self._connection_for(board_id)
+        self.publish_counts[index] += 1
+        return self.clients[index].publish(f"xVC5!GVcWEh4CF/neopixels/{board_id}/control", payload)
+
+    _encode = staticmethod(encode_message)
+
+    def _publish_message(self, message: Dict):
+        """Publish message to MQTT broker"""
+        payload = self._encode(message)
+        boards = self._target_boards()
+        for board_id in boards:
+            self._publish_to_board(board_id, payload)
+        self._record_frame(boards, [message])
+
+    def _record_frame(self, boards: List[str], messages: List[Dict]):
+        """Remember the LED colors sent to each board, for replay after a restart"""
+        updates = {led_num: hex_color for message in messages for led_num, hex_color in message.get("leds_hex", ())}
+        if updates:
+            for board_id in boards:
+                self.last_frames.setdefault(board_id, {}).update(updates)
+
+    def get_state(self) -> Dict:
+        """Active boards and last frames as JSON-serializable data"""
+        return {
+            "brightness": self.brightness,
+            "active_boards": {board_id: last_seen.timestamp() for board_id, last_seen in self.active_boards.items()},
+            "board_layouts": self.board_layouts,
+            "last_frames": {board_id: sorted(frame.items()) for board_id, frame in self.last_frames.items()},
+        }
+
+    def restore_state(self, state: Dict):
+        """Load state saved by get_state(). Saved boards count as seen now, so frames
+        can be sent before their next heartbeat; they time out as usual if it never comes."""
+        now = datetime.now()
+        self.brightness = state.get("brightness", self.brightness)
+        for board_id in state.get("active_boards", {}):
+            self.active_boards.setdefault(board_id, now)
+        self.board_layouts.update(state.get("board_layouts", {}))
+        self.last_frames = {board_id: {int(led_num): hex_color for led_num, hex_color in frame}
+                            for board_id, frame in state.get("last_frames", {}).items()}
+
+    def _replay_payloads(self):
+        """(board_id, payload) for every message needed to resend each board's last frame"""
+        for board_id, frame in self.last_frames.items():
+            layout = self.get_board_layout(board_id)
+            leds_hex = [pair for pair in sorted(frame.items()) if pair[0] < layout["led_count"]]
+            for message in self._chunk_leds_hex(leds_hex, layout["max_payload"]):
+                yield board_id, self._encode(message)
+
+    def replay_last_frames(self):
+        """Resend each board's last frame, e.g. right after a restart"""
+        for board_id, payload in self._replay_payloads():
+            self._publish_to_board(board_id, payload)
 
     def _on_connect(self, client, userdata, flags, rc, properties=None):
         if rc == 0:
             print("Connected to MQTT broker")
             # Subscribe to all heartbeat messages
             self.client.subscribe("xVC5!GVcWEh4CF/neopixels/+/heartbeat")
+            self.client.subscribe(self.profile_topic)
             if self.current_board:
                 self.client.subscribe(f"xVC5!GVcWEh4CF/neopixels/{self.current_board}/status")
         else:
@@ -127,17 +304,61 @@ class SimpleLEDController:
     def _on_message(self, client, userdata, msg):
         try:
             payload = json.loads(msg.payload)
+            if not isinstance(payload, dict):
+                print(f"Ignoring non-object message on {msg.topic}")
+                return
             # Handle heartbeat messages
             if "heartbeat" in msg.topic:
                 board_id = payload.get("boardId")
                 status = payload.get("status")
                 if board_id and status:
+                    self._check_board_restart(board_id, payload.get("timestamp"))
                     self._update_board_heartbeat(board_id, status)
+                    self._update_board_layout(board_id, payload.get("ledCount"), payload.get("maxPayload"))
                     print(f"Heartbeat from {board_id}: {status}")
-            
+            # Handle profiling commands, e.g. {"duration": 30, "mode": "sample"}
+            elif msg.topic == self.profile_topic and self.profiler is not None:
+                self.profiler.capture(payload.get("duration"), payload.get("mode", "sample"))
+
         except json.JSONDecodeError:
             print("Error parsing message")
 
+    def _check_board_restart(self, board_id: str, uptime):
+        """Flag a board for a full frame if it comes back after timing out, is heard from for the
+        first time since we started, or its uptime went backwards (it rebooted with its LEDs off)"""
+        last_seen = self.active_boards.get(board_id)
+        timed_out = last_seen is None or datetime.now() - last_seen > timedelta(seconds=self.timeout_seconds)
+        previous = self._board_uptimes.get(board_id)
+        if isinstance(uptime, (int, float)):
+            self._board_uptimes[board_id] = uptime
+        if timed_out or previous is None or (isinstance(uptime, (int, float)) and uptime < previous):
+            self._new_layouts.add(board_id)
+
+    def _update_board_layout(self, board_id: str, led_count, max_payload):
+        """Record the LED count and payload limit a board advertises in its heartbeat"""
+        layout = {
+            "led_count": led_count if isinstance(led_count, int) and led_count > 0 else self.num_leds,
+            "max_payload": max_payload if isinstance(max_payload, int) and max_payload > 0 else self.default_max_payload,
+        }
+        if self.board_layouts.get(board_id) != layout:
+            self.board_layouts[board_id] = layout
+            self._new_layouts.add(board_id)
+
+    def get_board_layout(self, board_id: str) -> Dict:
+        """LED count and largest control payload (bytes) of a board"""
+        return self.board_layouts.get(board_id) or {"led_count": self.num_leds, "max_payload": self.default_max_payload}
+
+    def get_led_numbers(self) -> range:
+        """Every LED number on the target boards, up to the longest strip"""
+        return range(max((self.get_board_layout(board_id)["led_count"] for board_id in self._target_boards(quiet=True)),
+                         default=self.num_leds))
+
+    def pop_new_layouts(self) -> List[str]:
+        """Boards that appeared, changed layout, rebooted or came back after timing out since the
+        last call, and so need a full frame"""
+        boards, self._new_layouts = self._new_layouts, set()
+        return sorted(boards)
+
     def get_board_history(self, board_id: str, hours: int = 24) -> List[Dict]:
         """Get board heartbeat history for the last n hours"""
         with sqlite3.connect(self.db_path) as conn:
@@ -183,37 +404,50 @@ class SimpleLEDController:
             print("No board selected!")
             return
 
-        hex_color = self._rgb_to_hex(r, g, b)
-
-        # Update all LEDs in chunks
-        for i in range(0, self.num_leds, self.chunk_size):
-            chunk = [(led_num, hex_color) for led_num in range(i, min(i + self.chunk_size, self.num_leds))]
-            
-            message = {
-                "leds_hex": chunk,
-                "brightness": self.brightness
-            }
-            self._publish_message(message)
+        self.set_multiple_leds({led_num: (r, g, b) for led_num in self.get_led_numbers()})
 
-    def set_multiple_leds(self, led_colors: Dict[int, tuple]):
+    def set_multiple_leds(self, led_colors: Dict[int, tuple], only_changed: bool = False):
         """Set multiple LEDs with different colors
-        led_colors: Dictionary mapping LED index to (r, g, b) tuple"""
+        led_colors: Dictionary mapping LED index to (r, g, b) tuple
+        only_changed: send each board only the LEDs that differ from its last frame"""
         if not self.current_board:
             print("No board selected!")
             return
 
-        # Convert input to the new format
-        leds_hex = [(led_num, self._rgb_to_hex(r, g, b)) for led_num, (r, g, b) in led_colors.items()
-                    if 0 <= led_num < self.num_leds]
-
-        # Send in chunks
-        for i in range(0, len(leds_hex), self.chunk_size):
-            chunk = leds_hex[i:i + self.chunk_size]
-            message = {
-                "leds_hex": chunk,
-                "brightness": self.brightness
-            }
-            self._publish_message(message)
+        for boards, messages in self._frame_messages(led_colors, only_changed):
+            for message in messages:
+                payload = self._encode(message)
+                for board_id in boards:
+                    self._publish_to_board(board_id, payload)
+            self._record_frame(boards, messages)
+
+    def _frame_messages(self, led_colors: Dict[int, tuple], only_changed: bool = False) -> List[Tuple[List[str], List[Dict]]]:
+        """Build the "leds_hex" messages for a set of LED colors, once per group of target
+        boards sharing a layout. With only_changed, each board gets just the LEDs that differ
+        from its entry in last_frames (all of them if it has none), so boards that missed
+        frames catch up; boards with the same changes still share messages. Returns
+        [(boards, messages), ...]."""
+        leds_hex = sorted((led_num, self._rgb_to_hex(r, g, b)) for led_num, (r, g, b) in led_colors.items()
+                          if led_num >= 0)
+        groups = {}
+        for board_id in self._target_boards():
+            layout = self.get_board_layout(board_id)
+            pairs = tuple(pair for pair in leds_hex if pair[0] < layout["led_count"])
+            if only_changed:
+                sent = self.last_frames.get(board_id, {})
+                pairs = tuple(pair for pair in pairs if sent.get(pair[0]) != pair[1])
+                if not pairs:
+                    continue
+            groups.setdefault((pairs, layout["max_payload"]), []).append(board_id)
+
+        return [
+            (boards, self._chunk_leds_hex(list(pairs), max_payload))
+            for (pairs, max_payload), boards in groups.items()
+        ]
+
+    def _chunk_leds_hex(self, leds_hex: List[tuple], max_payload: int) -> List[Dict]:
+        """chunk_leds_hex with the current brightness in every message"""
+        return chunk_leds_hex(leds_hex, max_payload, {"brightness": self.brightness})
 
     def all_off(self):
         """Turn all LEDs off using hex encoding"""
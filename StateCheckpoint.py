@@ -0,0 +1,76 @@
+import gzip
+import json
+import os
+import tempfile
+import time
+from typing import Dict, Optional
+
+
+class StateCheckpoint:
+    """
+    Periodic checkpoint of runtime state (train snapshot, active boards, last frame per board)
+    so a restarted main.py can light the display before its first fetch.
+
+    The state is written as gzipped JSON to a temporary file in the same directory, synced and
+    renamed over the previous checkpoint, so a crash mid-write never leaves a truncated file.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path="runtime_state.json.gz", interval=30, max_age=3600):
+        self.path = path
+        self.interval = interval  # Seconds between checkpoints in maybe_save()
+        self.max_age = max_age  # Older checkpoints are ignored on startup (seconds)
+        self.last_saved = 0.0
+
+    def save(self, tracker=None, controller=None):
+        """Write the tracker's and controller's state atomically."""
+        state = {'version': self.VERSION, 'saved_at': time.time()}
+        if tracker is not None:
+            state['tracker'] = tracker.get_state()
+        if controller is not None:
+            state['controller'] = controller.get_state()
+        data = gzip.compress(json.dumps(state, separators=(',', ':')).encode())
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(prefix='.runtime_state-', dir=directory)
+        try:
+            os.chmod(temp_path, 0o644)  # mkstemp creates the file owner-only
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self.last_saved = time.monotonic()
+        return len(data)
+
+    def maybe_save(self, tracker=None, controller=None):
+        """save() if at least interval seconds have passed since the last checkpoint."""
+        if time.monotonic() - self.last_saved >= self.interval:
+            try:
+                self.save(tracker, controller)
+            except OSError as e:
+                print(f"Error writing checkpoint: {str(e)}")
+
+    def load(self) -> Optional[Dict]:
+        """Read the last checkpoint, or None if there is no usable one."""
+        try:
+            with open(self.path, 'rb') as f:
+                state = json.loads(gzip.decompress(f.read()))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError) as e:
+            print(f"Ignoring unreadable checkpoint {self.path}: {str(e)}")
+            return None
+
+        if state.get('version') != self.VERSION:
+            print(f"Ignoring checkpoint {self.path} with version {state.get('version')}")
+            return None
+        age = time.time() - state['saved_at']
+        if age > self.max_age:
+            print(f"Ignoring checkpoint {self.path} from {age:.0f}s ago")
+            return None
+        return state
@@ -0,0 +1,213 @@
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+from geopy.distance import geodesic
+
+
+DIRECTION_INDEX = {'eastbound': 0, 'westbound': 1}  # Eastbound runs toward higher LED_IDs
+HOURS = 24
+
+
+class StationETA:
+    """
+    Next-arrival predictions for every station, built on ValleyMetroTracker change events.
+
+    Travel times between consecutive LED positions are kept per direction and hour of day in a
+    (2, 24, n_stations - 1) matrix, with its cumulative sums precomputed so the time between
+    any two stations is a single subtraction. Each train keeps a row of absolute arrival times
+    that is only recomputed when the train enters a new station.
+    """
+
+    def __init__(self, tracker, matrix_path=None, alpha=0.2, default_speed_kmh=30, default_dwell=30):
+        self.tracker = tracker
+        self.matrix_path = matrix_path
+        self.alpha = alpha  # EWMA weight of a new observation
+        self.max_ratio = 4.0  # Ignore observations this many times off the current estimate (layovers, outages)
+
+        # Route positions are LED_IDs; stations sharing an LED (one-way couplets) are averaged
+        positions = tracker.stations_df.groupby('LED_ID')[['POINT_Y', 'POINT_X']].mean().sort_index()
+        self.led_ids = positions.index.to_numpy()
+        self.led_index = {int(led_id): i for i, led_id in enumerate(self.led_ids)}
+        n = len(self.led_ids)
+
+        coords = positions.to_numpy()
+        distances_km = np.array([geodesic(coords[i], coords[i + 1]).kilometers for i in range(n - 1)])
+        default_segments = distances_km / default_speed_kmh * 3600 + default_dwell
+
+        self.segment_times = np.tile(default_segments.astype(np.float32), (2, HOURS, 1))
+        self.cumulative = np.zeros((2, HOURS, n))
+        if matrix_path and os.path.exists(matrix_path):
+            self.load(matrix_path)
+        self._rebuild_cumulative()
+
+        self.train_slots: Dict[str, int] = {}  # train_id -> row in arrival_times
+        self.arrival_times = np.full((0, 2, n), np.inf)  # Absolute epoch seconds per train, direction, station
+        self.last_entry: Dict[str, tuple] = {}  # train_id -> (station index, direction index, entered at)
+        self._next_arrival = np.full((2, n), np.inf)
+        self._dirty = False
+
+        tracker.subscribe(self._on_train_event)
+
+    def _rebuild_cumulative(self, direction=None, hour=None):
+        if direction is None:
+            self.cumulative[:, :, 1:] = np.cumsum(self.segment_times, axis=2)
+        else:
+            self.cumulative[direction, hour, 1:] = np.cumsum(self.segment_times[direction, hour])
+
+    def travel_time(self, from_led: int, to_led: int, direction: str, hour: Optional[int] = None) -> float:
+        """Typical seconds from one LED position to another in the given direction."""
+        hour = datetime.now().hour if hour is None else hour
+        d = DIRECTION_INDEX[direction]
+        cumulative = self.cumulative[d, hour]
+        return float(abs(cumulative[self.led_index[to_led]] - cumulative[self.led_index[from_led]]))
+
+    def _learn(self, d: int, start: int, end: int, elapsed: float, hour: int):
+        """Scale the segments between two stations toward an observed travel time."""
+        lo, hi = min(start, end), max(start, end)
+        expected = self.cumulative[d, hour, hi] - self.cumulative[d, hour, lo]
+        if expected <= 0 or elapsed <= 0:
+            return
+        ratio = elapsed / expected
+        if not 1 / self.max_ratio <= ratio <= self.max_ratio:
+            return
+        self.segment_times[d, hour, lo:hi] *= (1 - self.alpha) + self.alpha * ratio
+        self._rebuild_cumulative(d, hour)
+
+    def _predict(self, train_id: str, station: int, d: int, entered_at: float, hour: int):
+        """Recompute one train's absolute arrival times at every station ahead of it."""
+        slot = self.train_slots.get(train_id)
+        if slot is None:
+            slot = self.train_slots[train_id] = len(self.arrival_times)
+            self.arrival_times = np.concatenate([self.arrival_times, np.full((1,) + self.arrival_times.shape[1:], np.inf)])
+
+        row = self.arrival_times[slot]
+        row[:] = np.inf
+        cumulative = self.cumulative[d, hour]
+        if d == 0:
+            row[d, station:] = entered_at + cumulative[station:] - cumulative[station]
+        else:
+            row[d, :station + 1] = entered_at + cumulative[station] - cumulative[:station + 1]
+        self._dirty = True
+
+    def _remove(self, train_id: str):
+        slot = self.train_slots.pop(train_id, None)
+        self.last_entry.pop(train_id, None)
+        if slot is None:
+            return
+        # Move the last row into the freed slot to keep the array dense
+        last = len(self.arrival_times) - 1
+        if slot != last:
+            moved = next(t for t, s in self.train_slots.items() if s == last)
+            self.arrival_times[slot] = self.arrival_times[last]
+            self.train_slots[moved] = slot
+        self.arrival_times = self.arrival_times[:last]
+        self._dirty = True
+
+    def _on_train_event(self, event: Dict):
+        train_id = event['train_id']
+        if event['event'] == 'disappeared':
+            self._remove(train_id)
+            return
+        if event['event'] not in ('appeared', 'entered_station', 'direction_changed'):
+            return
+
+        d = DIRECTION_INDEX.get(event['direction'])
+        station = self.led_index.get(event['LED_ID'])
+        if d is None or station is None:
+            self._remove(train_id)
+            return
+
+        now = time.time()
+        hour = datetime.fromtimestamp(now).hour
+        previous = self.last_entry.get(train_id)
+        if event['event'] == 'direction_changed' and previous is not None and previous[0] == station:
+            entered_at = previous[2]  # Same stop, just turned around
+        else:
+            entered_at = now
+            if previous is not None and previous[1] == d and previous[0] != station:
+                moved_forward = station > previous[0] if d == 0 else station < previous[0]
+                if moved_forward:
+                    self._learn(d, previous[0], station, now - previous[2], hour)
+
+        self.last_entry[train_id] = (station, d, entered_at)
+        self._predict(train_id, station, d, entered_at, hour)
+
+    def _refresh(self):
+        if self._dirty:
+            if len(self.arrival_times):
+                self._next_arrival = self.arrival_times.min(axis=0)
+            else:
+                self._next_arrival = np.full(self._next_arrival.shape, np.inf)
+            self._dirty = False
+
+    def next_arrival(self, led_id: int, direction: str) -> Optional[float]:
+        """Seconds until the next train reaches a station in a direction (0 if one is there), or None."""
+        self._refresh()
+        station = self.led_index.get(led_id)
+        d = DIRECTION_INDEX.get(direction)
+        if station is None or d is None:
+            return None
+        arrival = self._next_arrival[d, station]
+        if not np.isfinite(arrival):
+            return None
+        return max(0.0, float(arrival - time.time()))
+
+    def get_station_etas(self) -> List[Dict]:
+        """
+        Next arrival for every station and direction.
+        Format: [{'LED_ID': int, 'eastbound': float or None, 'westbound': float or None}, ...]
+        """
+        self._refresh()
+        remaining = np.maximum(self._next_arrival - time.time(), 0.0)
+        finite = np.isfinite(remaining)
+        return [
+            {
+                'LED_ID': int(led_id),
+                'eastbound': float(remaining[0, i]) if finite[0, i] else None,
+                'westbound': float(remaining[1, i]) if finite[1, i] else None,
+            }
+            for i, led_id in enumerate(self.led_ids)
+        ]
+
+    def save(self, path: Optional[str] = None):
+        """Save the learned segment travel-time matrix."""
+        path = path or self.matrix_path
+        if path:
+            np.save(path, self.segment_times)
+
+    def load(self, path: str):
+        """Load a segment travel-time matrix saved by save(), if its shape matches the station table."""
+        segment_times = np.load(path)
+        if segment_times.shape == self.segment_times.shape:
+            self.segment_times = segment_times.astype(np.float32)
+            self._rebuild_cumulative()
+        else:
+            print(f"Ignoring travel-time matrix {path}: shape {segment_times.shape} does not match stations")
+
+
+# Example Usage
+if __name__ == "__main__":
+    import asyncio
+    from ValleyMetroTracker import ValleyMetroTracker
+
+    tracker = ValleyMetroTracker(
+        stations_csv='stations.csv',
+        gtfs_url="https://app.mecatran.com/utw/ws/gtfsfeed/vehicles/valleymetro?apiKey=4f22263f69671d7f49726c3011333e527368211f"
+    )
+    eta = StationETA(tracker, matrix_path="travel_times.npy")
+
+    async def main():
+        try:
+            while True:
+                await tracker.run_tracker()
+                for station in eta.get_station_etas():
+                    east = f"{station['eastbound'] / 60:.0f} min" if station['eastbound'] is not None else "-"
+                    west = f"{station['westbound'] / 60:.0f} min" if station['westbound'] is not None else "-"
+                    print(f"LED {station['LED_ID']:>2}: eastbound {east:>7}  westbound {west:>7}")
+        finally:
+            eta.save()
+
+    asyncio.run(main())
@@ -0,0 +1,240 @@
+import math
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def load_stops(path) -> pd.DataFrame:
+    """
+    Read a stop table. stations.csv is returned as is; a GTFS stops.txt is mapped onto the
+    same columns (LED_ID, StationName, POINT_X, POINT_Y) with LED_ID numbering the stops in
+    file order and stop_id kept alongside. Parent stations and entrances are dropped.
+    """
+    df = pd.read_csv(path)
+    if 'stop_lat' not in df.columns:
+        return df
+
+    if 'location_type' in df.columns:
+        df = df[df['location_type'].fillna(0).astype(int) == 0]
+    df = df.dropna(subset=['stop_lat', 'stop_lon']).reset_index(drop=True)
+    return pd.DataFrame({
+        'LED_ID': np.arange(len(df)),
+        'StationName': df['stop_name'],
+        'stop_id': df['stop_id'].astype(str),
+        'POINT_X': df['stop_lon'].astype(float),
+        'POINT_Y': df['stop_lat'].astype(float),
+    })
+
+
+class StopIndex:
+    """
+    Uniform grid over stop coordinates for nearest-stop lookups.
+
+    Cells are at least cell_km on a side. A lookup searches rings of cells outward from the
+    query's cell and stops once the best distance found is no further than the next ring can
+    possibly be, so it returns what a scan over every stop would (haversine distance) while
+    usually touching only the 3x3 block around the query. By default the cell size is picked
+    so there is about one stop per cell of the table's bounding box.
+    """
+
+    def __init__(self, lats, lons, cell_km=None):
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        self.size = len(lats)
+        self.lat_rad = np.radians(lats)
+        self.lon_rad = np.radians(lons)
+        self.cos_lat = np.cos(self.lat_rad)
+        # Lookups touch a handful of stops, plain floats beat numpy call overhead there
+        self._lat_rad: List[float] = self.lat_rad.tolist()
+        self._lon_rad: List[float] = self.lon_rad.tolist()
+        self._cos_lat: List[float] = self.cos_lat.tolist()
+
+        if cell_km is None:
+            cell_km = self._default_cell_km(lats, lons)
+        self.cell_km = cell_km
+
+        # Longitude cells are sized at the highest latitude so they are never narrower than cell_km
+        max_abs_lat = float(np.abs(lats).max()) if self.size else 0.0
+        self.lat_step = cell_km / KM_PER_DEGREE
+        self.lon_step = cell_km / (KM_PER_DEGREE * max(math.cos(math.radians(max_abs_lat)), 1e-6))
+
+        self.cells: Dict[Tuple[int, int], List[int]] = {}
+        if self.size:
+            cell_y = np.floor(lats / self.lat_step).astype(np.int64)
+            cell_x = np.floor(lons / self.lon_step).astype(np.int64)
+            order = np.lexsort((cell_x, cell_y))
+            keys = np.stack([cell_y[order], cell_x[order]], axis=1)
+            starts = np.flatnonzero(np.any(np.diff(keys, axis=0) != 0, axis=1)) + 1
+            for rows in np.split(order, starts):
+                self.cells[(int(cell_y[rows[0]]), int(cell_x[rows[0]]))] = rows.tolist()
+            self.min_y, self.max_y = int(cell_y.min()), int(cell_y.max())
+            self.min_x, self.max_x = int(cell_x.min()), int(cell_x.max())
+
+    @classmethod
+    def from_stations(cls, stations_df: pd.DataFrame, cell_km=None) -> 'StopIndex':
+        return cls(stations_df['POINT_Y'].to_numpy(), stations_df['POINT_X'].to_numpy(), cell_km)
+
+    @staticmethod
+    def _default_cell_km(lats: np.ndarray, lons: np.ndarray) -> float:
+        if len(lats) < 2:
+            return 1.0
+        height_km = (lats.max() - lats.min()) * KM_PER_DEGREE
+        width_km = (lons.max() - lons.min()) * KM_PER_DEGREE * math.cos(math.radians(float(np.abs(lats).max())))
+        return max(0.1, math.sqrt(max(height_km, 0.1) * max(width_km, 0.1) / len(lats)))
+
+    def distances(self, lat: float, lon: float) -> np.ndarray:
+        """Haversine distance (km) from a position to every stop."""
+        lat1 = math.radians(lat)
+        dlat = self.lat_rad - lat1
+        dlon = self.lon_rad - math.radians(lon)
+        a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * self.cos_lat * np.sin(dlon / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+    def _ring(self, cy: int, cx: int, r: int):
+        """Stop rows of the occupied cells on ring r around (cy, cx)."""
+        cells = self.cells
+        if r == 0:
+            rows = cells.get((cy, cx))
+            return [] if rows is None else [rows]
+
+        found = []
+        for y in range(max(cy - r, self.min_y), min(cy + r, self.max_y) + 1):
+            if y == cy - r or y == cy + r:
+                xs = range(max(cx - r, self.min_x), min(cx + r, self.max_x) + 1)
+            else:
+                xs = [x for x in (cx - r, cx + r) if self.min_x <= x <= self.max_x]
+            for x in xs:
+                rows = cells.get((y, x))
+                if rows is not None:
+                    found.append(rows)
+        return found
+
+    def nearest(self, lat: float, lon: float) -> Tuple[Optional[int], float]:
+        """Return (row, distance_km) of the stop closest to a position, (None, inf) if there are none."""
+        if not self.cells:
+            return None, float('inf')
+
+        cy = math.floor(lat / self.lat_step)
+        cx = math.floor(lon / self.lon_step)
+        # Rings closer than the grid's bounding box are empty; rings past its far side are too
+        r = max(0, self.min_y - cy, cy - self.max_y, self.min_x - cx, cx - self.max_x)
+        last_ring = max(cy - self.min_y, self.max_y - cy, cx - self.min_x, self.max_x - cx)
+
+        lat1 = math.radians(lat)
+        lon1 = math.radians(lon)
+        cos1 = math.cos(lat1)
+        lat_rad, lon_rad, cos_lat, sin = self._lat_rad, self._lon_rad, self._cos_lat, math.sin
+
+        # Compare haversine "a" terms, which grow with distance, and convert the winner only
+        best_row, best_a, best_km = None, float('inf'), float('inf')
+        while r <= last_ring:
+            for rows in self._ring(cy, cx, r):
+                for row in rows:
+                    a = sin((lat_rad[row] - lat1) / 2) ** 2 + cos1 * cos_lat[row] * sin((lon_rad[row] - lon1) / 2) ** 2
+                    # Ties go to the lowest row, as in a scan over every stop
+                    if a < best_a or (a == best_a and row < best_row):
+                        best_row, best_a = row, a
+            if best_row is not None:
+                best_km = 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(best_a))
+            # Anything in ring r + 1 or beyond is at least r whole cells away
+            if best_km <= r * self.cell_km:
+                break
+            r += 1
+        return best_row, best_km
+
+    def nearest_brute_force(self, lat: float, lon: float) -> Tuple[Optional[int], float]:
+        """Reference answer: distance to every stop."""
+        if not self.size:
+            return None, float('inf')
+        distances = self.distances(lat, lon)
+        i = int(distances.argmin())
+        return i, float(distances[i])
+
+
+def synthetic_stops(num_stops=6000, seed=0) -> pd.DataFrame:
+    """Bus-network style stop table: stops every few hundred metres along a street grid."""
+    rng = np.random.default_rng(seed)
+    lat_min, lat_max, lon_min, lon_max = 33.20, 33.80, -112.45, -111.60
+    # Half the stops on east-west streets, half on north-south streets, one mile apart
+    mile_lat, mile_lon = 1.609 / KM_PER_DEGREE, 1.609 / (KM_PER_DEGREE * math.cos(math.radians(33.5)))
+    half = num_stops // 2
+    ew_lat = lat_min + rng.integers(0, int((lat_max - lat_min) / mile_lat), half) * mile_lat
+    ew_lon = rng.uniform(lon_min, lon_max, half)
+    ns_lon = lon_min + rng.integers(0, int((lon_max - lon_min) / mile_lon), num_stops - half) * mile_lon
+    ns_lat = rng.uniform(lat_min, lat_max, num_stops - half)
+    lats = np.concatenate([ew_lat, ns_lat]) + rng.normal(0, 0.0002, num_stops)
+    lons = np.concatenate([ew_lon, ns_lon]) + rng.normal(0, 0.0002, num_stops)
+    return pd.DataFrame({
+        'LED_ID': np.arange(num_stops),
+        'StationName': [f"Stop {i}" for i in range(num_stops)],
+        'POINT_X': lons,
+        'POINT_Y': lats,
+    })
+
+
+# Correctness check against brute force, and a full-network benchmark
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from geopy.distance import geodesic
+
+    parser = argparse.ArgumentParser(description="Check and benchmark the nearest-stop grid index")
+    parser.add_argument("--stops", help="stations.csv or GTFS stops.txt (default: synthetic)")
+    parser.add_argument("--num-stops", type=int, default=6000, help="Synthetic stop count")
+    parser.add_argument("--vehicles", type=int, default=1000)
+    parser.add_argument("--cell-km", type=float, help="Grid cell size (default: about one stop per cell)")
+    parser.add_argument("--check", type=int, default=20000, help="Random positions checked against brute force")
+    parser.add_argument("--geodesic-sample", type=int, default=20, help="Vehicles timed on the iterrows x geodesic path")
+    args = parser.parse_args()
+
+    stops = load_stops(args.stops) if args.stops else synthetic_stops(args.num_stops)
+    start = time.perf_counter()
+    index = StopIndex.from_stations(stops, args.cell_km)
+    build = time.perf_counter() - start
+    print(f"{len(stops)} stops, {len(index.cells)} occupied cells of {index.cell_km:.2f} km, built in {build * 1000:.1f} ms")
+
+    # Positions inside the network plus some well outside it (deadheads, bad GPS)
+    rng = np.random.default_rng(1)
+    lat_lo, lat_hi = stops['POINT_Y'].min(), stops['POINT_Y'].max()
+    lon_lo, lon_hi = stops['POINT_X'].min(), stops['POINT_X'].max()
+    pad_lat, pad_lon = (lat_hi - lat_lo) * 0.5 + 0.01, (lon_hi - lon_lo) * 0.5 + 0.01
+    inside = args.check * 9 // 10
+    check_lats = np.concatenate([rng.uniform(lat_lo, lat_hi, inside),
+                                 rng.uniform(lat_lo - pad_lat, lat_hi + pad_lat, args.check - inside)])
+    check_lons = np.concatenate([rng.uniform(lon_lo, lon_hi, inside),
+                                 rng.uniform(lon_lo - pad_lon, lon_hi + pad_lon, args.check - inside)])
+    # The index uses scalar math and brute force numpy, so distances may differ in the last bits
+    mismatches = 0
+    for lat, lon in zip(check_lats, check_lons):
+        (row, km), (expected_row, expected_km) = index.nearest(lat, lon), index.nearest_brute_force(lat, lon)
+        if abs(km - expected_km) > 1e-9 or (row != expected_row and abs(km - index.distances(lat, lon)[row]) > 1e-9):
+            mismatches += 1
+            print(f"  mismatch at ({lat:.6f}, {lon:.6f}): {(row, km)} vs {(expected_row, expected_km)}")
+    print(f"Check: {args.check - mismatches}/{args.check} positions match brute force")
+
+    # Station choice compared with the original iterrows x geodesic scan
+    stop_coords = list(zip(stops['POINT_Y'], stops['POINT_X']))
+    sample = min(args.geodesic_sample, args.vehicles)
+    vehicle_lats = rng.uniform(lat_lo, lat_hi, args.vehicles)
+    vehicle_lons = rng.uniform(lon_lo, lon_hi, args.vehicles)
+    start = time.perf_counter()
+    agree = 0
+    for lat, lon in zip(vehicle_lats[:sample], vehicle_lons[:sample]):
+        distances = [geodesic((lat, lon), coords).kilometers for coords in stop_coords]
+        agree += int(np.argmin(distances)) == index.nearest(lat, lon)[0]
+    geodesic_time = (time.perf_counter() - start) / sample
+    print(f"Geodesic scan picks the same stop for {agree}/{sample} vehicles")
+
+    print(f"\n{args.vehicles} vehicles, per update cycle:")
+    print(f"  geodesic scan     {geodesic_time * args.vehicles * 1000:>10.1f} ms (extrapolated from {sample})")
+    for label, lookup in (("numpy brute force", index.nearest_brute_force), ("grid index", index.nearest)):
+        start = time.perf_counter()
+        for lat, lon in zip(vehicle_lats, vehicle_lons):
+            lookup(lat, lon)
+        print(f"  {label:<17} {(time.perf_counter() - start) * 1000:>10.1f} ms")
@@ -1,16 +1,31 @@
 import requests
-import pandas as pd
-from geopy.distance import geodesic
 from google.transit import gtfs_realtime_pb2
 from datetime import datetime
+from collections import deque, OrderedDict
 import asyncio
 import aiohttp
+import time
+from google.protobuf.message import DecodeError
+from FeedDecoder import decode_feed
+from StopIndex import StopIndex, load_stops
 
 
 class ValleyMetroTracker:
-    def __init__(self, stations_csv, gtfs_url):
-        self.stations_df = pd.read_csv(stations_csv)  # Load station data
+    def __init__(self, stations_csv, gtfs_url, position_store=None, route_prefixes=('RAIL',)):
+        # Station assignment cache keyed on quantized (lat, lon) cells
+        self.station_cache = OrderedDict()  # (lat cell, lon cell) -> (station_name, LED_ID, distance_km)
+        self.station_cache_cell = 1e-4  # Cell size in degrees (~11 m)
+        self.station_cache_per_vehicle = 32  # Cells kept per active vehicle
+        self.station_cache_min_size = 256
+        self.station_cache_hits = 0
+        self.station_cache_misses = 0
+        self.train_position_hits = 0  # Lookups skipped because a train had not moved
+        self.stop_index_cell_km = None  # Grid cell size of the station index, None sizes it to the table
+
+        # stations.csv or a GTFS stops.txt
+        self.stations_df = load_stops(stations_csv)
         self.gtfs_url = gtfs_url
+        self.position_store = position_store  # Optional PositionStore for history
         self.train_locations = []  # Store train locations
         self.update_interval = 5  # Interval to ping the endpoint (seconds)
         self.direction_colors = {
@@ -19,6 +34,51 @@ class ValleyMetroTracker:
             'unknown': 'gray'
         }
 
+        # Fetch latency budget and hedging
+        self.fetch_timeout = 10  # Hard latency budget per fetch (seconds)
+        self.hedge_requests = True  # Fire a second request when the first exceeds the p95
+        self.min_hedge_samples = 20  # Latency samples needed before hedging kicks in
+        self.fetch_latencies = deque(maxlen=100)  # Recent successful fetch latencies (seconds)
+
+        # Circuit breaker
+        self.breaker_failure_threshold = 3  # Consecutive failures before the breaker opens
+        self.breaker_cooldown = 60  # Seconds to wait before a trial request
+        self.consecutive_failures = 0
+        self.breaker_open_until = 0.0
+
+        # Last good snapshot
+        self.last_good_time = None  # time.time() of the last successful fetch
+
+        # Vehicles on routes starting with one of these prefixes are tracked (None: every route).
+        # Only entities on matching routes are decoded from the wire (see FeedDecoder)
+        self.route_prefixes = route_prefixes
+        self.selective_decoding = True
+
+        # Vehicle table keyed by feed entity id, so DIFFERENTIAL feeds can be applied in place
+        self.vehicles = {}
+        self.vehicle_refreshed = {}  # entity id -> time.time() of its last update
+        self.vehicle_ttl = 120  # Evict vehicles not refreshed for this long (seconds)
+
+        # Per-train state carried across fetches, and change event subscribers
+        self.train_states = {}  # train_id -> {'position', 'station_name', 'LED_ID', 'distance_km', 'direction'}
+        self.event_subscribers = []
+
+    @property
+    def stations_df(self):
+        return self._stations_df
+
+    @stations_df.setter
+    def stations_df(self, stations_df):
+        """Replace the station table, rebuilding its spatial index and invalidating every cached station assignment."""
+        self._stations_df = stations_df
+        self.stop_index = StopIndex.from_stations(stations_df, self.stop_index_cell_km)
+        self._station_names = stations_df['StationName'].tolist()
+        self._station_leds = stations_df['LED_ID'].astype(int).tolist()
+        self.station_cache.clear()
+        # Force a fresh lookup for every known train on the next update
+        for state in getattr(self, 'train_states', {}).values():
+            state['position'] = None
+
     def determine_train_direction(self, train):
         """Determine if a train is eastbound or westbound."""
         if 'EAST' in train['trip_id'].upper():
@@ -33,47 +93,228 @@ class ValleyMetroTracker:
                 return 'westbound'
         return 'unknown'
 
+    def _train_record(self, vehicle):
+        """Convert a GTFS-realtime VehiclePosition into a train location record."""
+        bearing = vehicle.position.bearing if vehicle.position.HasField('bearing') else None
+        return {
+            'lat': vehicle.position.latitude,
+            'lon': vehicle.position.longitude,
+            'train_id': vehicle.vehicle.id,
+            'route_id': vehicle.trip.route_id,
+            'trip_id': vehicle.trip.trip_id,
+            'timestamp': datetime.fromtimestamp(vehicle.timestamp),
+            'speed': vehicle.position.speed if vehicle.position.HasField('speed') else None,
+            'bearing': bearing,
+            'direction': self.determine_train_direction({
+                'trip_id': vehicle.trip.trip_id,
+                'bearing': bearing,
+            })
+        }
+
+    def route_matches(self, route_id):
+        """Whether vehicles on a route are tracked."""
+        return self.route_prefixes is None or route_id.startswith(tuple(self.route_prefixes))
+
+    def _parse_feed(self, response_data):
+        """
+        Parse a GTFS-realtime payload into (FeedHeader, entities).
+        With selective_decoding only entities whose vehicle.trip.route_id (read from the wire
+        format) starts with one of route_prefixes, or already in the vehicle table, are decoded;
+        anything the wire scan cannot handle gets a full parse.
+        """
+        if self.selective_decoding and self.route_prefixes is not None:
+            try:
+                return decode_feed(response_data, self.route_prefixes, keep_ids=self.vehicles.keys())
+            except (ValueError, IndexError, DecodeError) as e:
+                print(f"Selective decoding failed, parsing the full feed: {str(e)}")
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(response_data)
+        return feed.header, feed.entity
+
+    def _apply_feed(self, header, entities):
+        """
+        Apply feed entities to the vehicle table and rebuild train_locations.
+        FULL_DATASET feeds replace the table; DIFFERENTIAL feeds update and delete
+        entities in place. Vehicles not refreshed within vehicle_ttl are evicted either way.
+        """
+        now = time.time()
+        if header.incrementality != gtfs_realtime_pb2.FeedHeader.DIFFERENTIAL:
+            self.vehicles = {}
+            self.vehicle_refreshed = {}
+
+        for entity in entities:
+            entity_id = entity.id or entity.vehicle.vehicle.id
+            if entity.is_deleted:
+                self.vehicles.pop(entity_id, None)
+                self.vehicle_refreshed.pop(entity_id, None)
+            elif entity.HasField('vehicle'):
+                if self.route_matches(entity.vehicle.trip.route_id):
+                    self.vehicles[entity_id] = self._train_record(entity.vehicle)
+                    self.vehicle_refreshed[entity_id] = now
+                else:
+                    # The vehicle may have been reassigned off a rail route
+                    self.vehicles.pop(entity_id, None)
+                    self.vehicle_refreshed.pop(entity_id, None)
+
+        expired = [entity_id for entity_id, refreshed in self.vehicle_refreshed.items()
+                   if now - refreshed > self.vehicle_ttl]
+        for entity_id in expired:
+            del self.vehicles[entity_id]
+            del self.vehicle_refreshed[entity_id]
+
+        self.train_locations = list(self.vehicles.values())
+
+    def _hedge_delay(self):
+        """Return the p95 fetch latency, or None if hedging is off or there is too little history."""
+        if not self.hedge_requests or len(self.fetch_latencies) < self.min_hedge_samples:
+            return None
+        latencies = sorted(self.fetch_latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def breaker_is_open(self):
+        """True while the circuit breaker is refusing requests."""
+        return time.time() < self.breaker_open_until
+
+    def _record_success(self, latency):
+        self.fetch_latencies.append(latency)
+        self.consecutive_failures = 0
+        self.breaker_open_until = 0.0
+        self.last_good_time = time.time()
+
+    def _record_failure(self):
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.breaker_failure_threshold:
+            self.breaker_open_until = time.time() + self.breaker_cooldown
+            print(f"Circuit breaker open for {self.breaker_cooldown}s after "
+                  f"{self.consecutive_failures} consecutive failures")
+
+    async def _request_feed(self, session):
+        async with session.get(self.gtfs_url) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    async def _hedged_request(self, session):
+        """Request the feed, firing a second request if the first is slower than the p95."""
+        tasks = {asyncio.ensure_future(self._request_feed(session))}
+        try:
+            hedge_delay = self._hedge_delay()
+            if hedge_delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done:
+                    tasks.add(asyncio.ensure_future(self._request_feed(session)))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
     async def fetch_train_data(self):
-        """Async fetch GTFS data and update train locations."""
-        async with aiohttp.ClientSession() as session:
+        """
+        Async fetch GTFS data and update train locations.
+        On failure the last good snapshot is kept; see get_snapshot() for its age.
+        """
+        if self.breaker_is_open():
+            return
+        start = time.monotonic()
+        try:
+            timeout = aiohttp.ClientTimeout(total=self.fetch_timeout)
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                response_data = await asyncio.wait_for(self._hedged_request(session), self.fetch_timeout)
+            self._apply_feed(*self._parse_feed(response_data))
+            self._record_success(time.monotonic() - start)
+            self.update_train_states()
+        except Exception as e:
+            print(f"Error fetching train data: {e}")
+            self._record_failure()
+            return
+
+        # History is best effort: a write error must not count against the feed's circuit breaker
+        if self.position_store is not None:
             try:
-                async with session.get(self.gtfs_url) as response:
-                    response_data = await response.read()
-                    feed = gtfs_realtime_pb2.FeedMessage()
-                    feed.ParseFromString(response_data)
-                    self.train_locations = [
-                        {
-                            'lat': entity.vehicle.position.latitude,
-                            'lon': entity.vehicle.position.longitude,
-                            'train_id': entity.vehicle.vehicle.id,
-                            'route_id': entity.vehicle.trip.route_id,
-                            'trip_id': entity.vehicle.trip.trip_id,
-                            'timestamp': datetime.fromtimestamp(entity.vehicle.timestamp),
-                            'speed': entity.vehicle.position.speed if entity.vehicle.position.HasField('speed') else None,
-                            'bearing': entity.vehicle.position.bearing if entity.vehicle.position.HasField('bearing') else None,
-                            'direction': self.determine_train_direction({
-                                'trip_id': entity.vehicle.trip.trip_id,
-                                'bearing': entity.vehicle.position.bearing if entity.vehicle.position.HasField('bearing') else None,
-                            })
-                        }
-                        for entity in feed.entity if entity.HasField('vehicle') and entity.vehicle.trip.route_id.startswith('RAIL')
-                    ]
-            except Exception as e:
-                print(f"Error fetching train data: {e}")
-                self.train_locations = []
+                self.position_store.record(self.train_locations, self.train_states)
+            except OSError as e:
+                print(f"Error writing position history: {e}")
+
+    def report_update(self):
+        """Print whether the latest fetch succeeded or how old the served snapshot is."""
+        age = self.get_snapshot_age()
+        if age is not None and age < self.update_interval:
+            print(f"Updated train data at {datetime.now()}")
+        elif age is None:
+            print("No train data yet")
+        else:
+            print(f"Serving last good train data ({age:.0f}s old)")
 
     async def start_tracker(self):
         """Continuously ping the GTFS endpoint."""
         while True:
             await self.fetch_train_data()
-            print(f"Updated train data at {datetime.now()}")
+            self.report_update()
             await asyncio.sleep(self.update_interval)
             
     async def run_tracker(self):
         await self.fetch_train_data()
-        print(f"Updated train data at {datetime.now()}")
+        self.report_update()
         await asyncio.sleep(self.update_interval)
 
+    def get_snapshot_age(self):
+        """Seconds since the last successful fetch, or None if no fetch has succeeded yet."""
+        if self.last_good_time is None:
+            return None
+        return time.time() - self.last_good_time
+
+    def get_snapshot(self):
+        """
+        Return the last good train snapshot and its age.
+        Format: (train_locations, age_seconds) where age_seconds is None before the first good fetch.
+        """
+        return self.train_locations, self.get_snapshot_age()
+
+    def get_state(self):
+        """
+        Vehicle table, per-train state and snapshot time as JSON-serializable data, so a
+        restarted tracker can serve the last snapshot before its first fetch.
+        """
+        return {
+            'last_good_time': self.last_good_time,
+            'vehicles': {
+                entity_id: dict(record, timestamp=record['timestamp'].timestamp())
+                for entity_id, record in self.vehicles.items()
+            },
+            'vehicle_refreshed': self.vehicle_refreshed,
+            'train_states': self.train_states,
+        }
+
+    def restore_state(self, state):
+        """Load state saved by get_state(). The snapshot keeps its original age."""
+        self.last_good_time = state['last_good_time']
+        self.vehicles = {
+            entity_id: dict(record, timestamp=datetime.fromtimestamp(record['timestamp']))
+            for entity_id, record in state['vehicles'].items()
+        }
+        self.vehicle_refreshed = dict(state['vehicle_refreshed'])
+        self.train_states = {
+            train_id: dict(train_state, position=tuple(train_state['position']) if train_state['position'] else None)
+            for train_id, train_state in state['train_states'].items()
+        }
+        self.train_locations = list(self.vehicles.values())
+
+    def replay_events(self):
+        """
+        Emit an 'appeared' event for every train currently tracked, e.g. after restore_state(),
+        so subscribers registered before the restore see the restored trains. Returns the events.
+        """
+        events = [self._train_event('appeared', train_id, state) for train_id, state in self.train_states.items()]
+        self._emit(events)
+        return events
+
     def get_train_locations(self):
         """
         Return a list of trains with their locations and direction.
@@ -89,35 +330,141 @@ class ValleyMetroTracker:
             for train in self.train_locations
         ]
 
+    def subscribe(self, callback):
+        """
+        Register a callback for per-train change events.
+        The callback receives one event dict per change, e.g.
+        {'event': 'entered_station', 'train_id': str, 'station_name': str, 'LED_ID': int, 'direction': str}
+        Event types: appeared, disappeared, entered_station, left_station, direction_changed.
+        """
+        self.event_subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """Remove a previously registered event callback."""
+        if callback in self.event_subscribers:
+            self.event_subscribers.remove(callback)
+
+    def _emit(self, events):
+        for event in events:
+            for callback in list(self.event_subscribers):
+                try:
+                    callback(event)
+                except Exception as e:
+                    print(f"Error in train event subscriber: {e}")
+
+    def _train_event(self, event_type, train_id, state, **extra):
+        event = {
+            'event': event_type,
+            'train_id': train_id,
+            'station_name': state['station_name'],
+            'LED_ID': state['LED_ID'],
+            'direction': state['direction'],
+        }
+        event.update(extra)
+        return event
+
+    def _find_closest_station(self, lat, lon):
+        """Return (station_name, LED_ID, distance_km) for the station closest to a position."""
+        row, distance = self.stop_index.nearest(lat, lon)
+        if row is None:
+            return None, None, distance
+        return self._station_names[row], self._station_leds[row], distance
+
+    def _closest_station_cached(self, lat, lon):
+        """
+        Return (station_name, LED_ID, distance_km) for a position, served from the
+        quantized-cell LRU cache when possible.
+        """
+        key = (round(lat / self.station_cache_cell), round(lon / self.station_cache_cell))
+        cached = self.station_cache.get(key)
+        if cached is not None:
+            self.station_cache.move_to_end(key)
+            self.station_cache_hits += 1
+            return cached
+
+        self.station_cache_misses += 1
+        result = self._find_closest_station(lat, lon)
+        self.station_cache[key] = result
+
+        capacity = max(self.station_cache_min_size, self.station_cache_per_vehicle * len(self.train_locations))
+        while len(self.station_cache) > capacity:
+            self.station_cache.popitem(last=False)
+        return result
+
+    def get_station_cache_stats(self):
+        """Return station assignment cache counters."""
+        lookups = self.station_cache_hits + self.station_cache_misses
+        return {
+            'size': len(self.station_cache),
+            'hits': self.station_cache_hits,
+            'misses': self.station_cache_misses,
+            'hit_rate': self.station_cache_hits / lookups if lookups else 0.0,
+            'unchanged_position_hits': self.train_position_hits,
+        }
+
+    def update_train_states(self):
+        """
+        Diff the current train locations against the per-train state from the previous
+        fetch, notify subscribers and return the list of change events.
+        Only trains whose position changed get a new closest-station lookup.
+        """
+        events = []
+        seen = set()
+
+        for train in self.train_locations:
+            train_id = train['train_id']
+            seen.add(train_id)
+            previous = self.train_states.get(train_id)
+            position = (train['lat'], train['lon'])
+
+            if previous is not None and previous['position'] == position:
+                station_name, led_id, distance = previous['station_name'], previous['LED_ID'], previous['distance_km']
+                self.train_position_hits += 1
+            else:
+                station_name, led_id, distance = self._closest_station_cached(*position)
+
+            state = {
+                'position': position,
+                'station_name': station_name,
+                'LED_ID': led_id,
+                'distance_km': distance,
+                'direction': train['direction'],
+            }
+            self.train_states[train_id] = state
+
+            if previous is None:
+                events.append(self._train_event('appeared', train_id, state))
+                continue
+            if previous['LED_ID'] != led_id:
+                events.append(self._train_event('left_station', train_id, previous))
+                events.append(self._train_event('entered_station', train_id, state))
+            if previous['direction'] != state['direction']:
+                events.append(self._train_event('direction_changed', train_id, state,
+                                                previous_direction=previous['direction']))
+
+        for train_id in [train_id for train_id in self.train_states if train_id not in seen]:
+            events.append(self._train_event('disappeared', train_id, self.train_states.pop(train_id)))
+
+        self._emit(events)
+        return events
+
     def get_train_closest_stations(self):
         """
         For each train, determine the closest station and direction.
         Format: [{'train_id': str, 'station_name': str, 'LED_ID': int, 'direction': str}, ...]
         """
-        closest_stations = []
+        if set(self.train_states) != {train['train_id'] for train in self.train_locations}:
+            self.update_train_states()
 
-        for train in self.train_locations:
-            min_distance = float('inf')
-            closest_station = None
-
-            train_coords = (train['lat'], train['lon'])
-            for idx, station in self.stations_df.iterrows():
-                station_coords = (station['POINT_Y'], station['POINT_X'])
-                distance = geodesic(train_coords, station_coords).kilometers
-
-                if distance < min_distance:
-                    min_distance = distance
-                    closest_station = station
-
-            if closest_station is not None:
-                closest_stations.append({
-                    'train_id': train['train_id'],
-                    'station_name': closest_station['StationName'],
-                    'LED_ID': closest_station['LED_ID'],
-                    'direction': train['direction']
-                })
-
-        return closest_stations
+        return [
+            {
+                'train_id': train_id,
+                'station_name': state['station_name'],
+                'LED_ID': state['LED_ID'],
+                'direction': state['direction']
+            }
+            for train_id, state in self.train_states.items() if state['LED_ID'] is not None
+        ]
 
 
 # Example Usage
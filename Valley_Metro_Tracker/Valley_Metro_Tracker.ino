@@ -17,6 +17,12 @@
 #define LED_COUNT   45
 #define INITIAL_BRIGHTNESS  50
 
+// Message limits, advertised in the heartbeat so the server packs frames to fit.
+// A leds_hex pair ([index,"RRGGBB"],) is at most 16 bytes, so a full frame fits in one message.
+#define MAX_PAYLOAD (LED_COUNT * 16 + 64)
+// JSON pool for a full frame: one array slot per LED, its [index, color] pair and the copied color string
+#define JSON_DOC_SIZE (JSON_ARRAY_SIZE(LED_COUNT) + LED_COUNT * (JSON_ARRAY_SIZE(2) + 8) + JSON_OBJECT_SIZE(8) + 64)
+
 // MQTT settings (these could also be made configurable via the portal)
 const char* mqtt_server = "test.mosquitto.org";
 const int mqtt_port = 1883;
@@ -44,6 +50,8 @@ DNSServer dnsServer;
 // Global variables
 String boardId;
 char topicBuffer[50];
+DynamicJsonDocument jsonDoc(JSON_DOC_SIZE);  // Shared by control messages and status reports
+char payloadBuffer[MAX_PAYLOAD];
 bool isConfigMode = false;
 
 // HTML page
@@ -318,6 +326,7 @@ void configModeLEDIndicator() {
 void setupMQTT() {
     mqtt.setServer(mqtt_server, mqtt_port);
     mqtt.setCallback(callback);
+    mqtt.setBufferSize(MAX_PAYLOAD + 128);  // Payload plus topic and header
     reconnectMQTT();
 }
 
@@ -342,7 +351,7 @@ void reconnectMQTT() {
 }
 
 void callback(char* topic, byte* payload, unsigned int length) {
-    StaticJsonDocument<2048> doc;
+    JsonDocument& doc = jsonDoc;
     DeserializationError error = deserializeJson(doc, payload, length);
     if (error) {
         Serial.print("deserializeJson() failed: ");
@@ -416,7 +425,8 @@ void callback(char* topic, byte* payload, unsigned int length) {
 }
 
 void publishStatus() {
-    StaticJsonDocument<2048> doc;
+    JsonDocument& doc = jsonDoc;
+    doc.clear();
 
     // Compact "leds_hex" status reporting
     JsonArray leds_hex = doc.createNestedArray("leds_hex");
@@ -434,11 +444,10 @@ void publishStatus() {
     doc["brightness"] = strip.getBrightness();
     doc["boardId"] = boardId;
 
-    char buffer[2048];
-    serializeJson(doc, buffer);
+    serializeJson(doc, payloadBuffer, sizeof(payloadBuffer));
 
     sprintf(topicBuffer, "xVC5!GVcWEh4CF/neopixels/%s/status", boardId.c_str());
-    mqtt.publish(topicBuffer, buffer);
+    mqtt.publish(topicBuffer, payloadBuffer);
 }
 
 void publishHeartbeat() {
@@ -446,6 +455,8 @@ void publishHeartbeat() {
     doc["boardId"] = boardId;
     doc["status"] = "online";  // Indicates the device is operational
     doc["timestamp"] = millis();  // Use device uptime in milliseconds
+    doc["ledCount"] = LED_COUNT;
+    doc["maxPayload"] = MAX_PAYLOAD;  // Largest control message this board accepts (bytes)
 
     char buffer[256];
     serializeJson(doc, buffer);
@@ -0,0 +1,320 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+from typing import Dict, List
+
+from LocalBroker import LocalBroker, MiniMQTTClient
+from SimpleLEDController import SimpleLEDController
+
+TOPIC_PREFIX = "xVC5!GVcWEh4CF/neopixels"
+LED_COUNT = 45
+PUBSUBCLIENT_PACKET_SIZE = 256  # Default packet buffer of firmware that does not advertise a layout
+
+
+def firmware_max_payload(led_count: int) -> int:
+    """MAX_PAYLOAD of the firmware built for a strip length"""
+    return led_count * 16 + 64
+
+
+class SimulatedBoard:
+    """
+    Emulates the ESP32 firmware: heartbeat, control message parsing and publishStatus.
+    With advertise=False it behaves like older firmware, which does not send its layout and
+    drops packets larger than PubSubClient's default buffer.
+    The last LED is unused by the route and carries the frame sequence number.
+    """
+
+    def __init__(self, board_id: str, heartbeat_interval: float, stats: Dict, led_count: int = LED_COUNT,
+                 advertise: bool = True):
+        self.board_id = board_id
+        self.heartbeat_interval = heartbeat_interval
+        self.stats = stats
+        self.led_count = led_count
+        self.advertise = advertise
+        self.pixels = [0] * led_count
+        self.brightness = 50
+        self.control_topic = f"{TOPIC_PREFIX}/{board_id}/control"
+        # The payload shares the packet buffer with the fixed header (1 byte), the remaining length
+        # (up to 4 bytes, reserved in full by PubSubClient), the topic length (2 bytes) and the topic
+        self.max_payload = (firmware_max_payload(led_count) if advertise
+                            else PUBSUBCLIENT_PACKET_SIZE - 7 - len(self.control_topic))
+        self.client = MiniMQTTClient(f"ESP32Client-{board_id}", on_message=self._callback)
+        self._heartbeat_task = None
+
+    async def start(self, host: str, port: int):
+        await self.client.connect(host, port)
+        self.client.subscribe(self.control_topic)
+        self.publish_status()
+        self._heartbeat_task = asyncio.ensure_future(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+        await self.client.disconnect()
+
+    async def _heartbeat_loop(self):
+        # Spread the fleet's heartbeats across the interval like boards booting at different times
+        await asyncio.sleep(random.uniform(0, self.heartbeat_interval))
+        while True:
+            self.publish_heartbeat()
+            await asyncio.sleep(self.heartbeat_interval)
+
+    def publish_heartbeat(self):
+        heartbeat = {
+            "boardId": self.board_id,
+            "status": "online",
+            "timestamp": int(time.monotonic() * 1000),
+        }
+        if self.advertise:
+            heartbeat.update(ledCount=self.led_count, maxPayload=self.max_payload)
+        payload = json.dumps(heartbeat)
+        self.client.publish(f"{TOPIC_PREFIX}/{self.board_id}/heartbeat", payload.encode())
+
+    def publish_status(self):
+        doc = {
+            "leds_hex": [[i, f"{color:06X}"] for i, color in enumerate(self.pixels)],
+            "brightness": self.brightness,
+            "boardId": self.board_id,
+        }
+        self.client.publish(f"{TOPIC_PREFIX}/{self.board_id}/status", json.dumps(doc).encode())
+
+    def _callback(self, topic: str, payload: bytes):
+        if topic != self.control_topic:
+            return
+        self.stats['messages'] += 1
+        if len(payload) > self.max_payload:
+            self.stats['overflows'] += 1
+            return
+        try:
+            doc = json.loads(payload)
+        except ValueError:
+            self.stats['parse_errors'] += 1
+            return
+
+        cmd = doc.get("cmd")
+        if cmd == "all_off":
+            self.pixels = [0] * self.led_count
+        elif cmd == "all_on":
+            color = (doc.get("r", 255) << 16) | (doc.get("g", 255) << 8) | doc.get("b", 255)
+            self.pixels = [color] * self.led_count
+        else:
+            if "brightness" in doc:
+                self.brightness = doc["brightness"]
+            for index, hex_color in doc.get("leds_hex", []):
+                if 0 <= index < self.led_count:
+                    self.pixels[index] = int(hex_color, 16)
+                    if index == self.led_count - 1:
+                        self._frame_complete(self.pixels[index])
+            for led in doc.get("leds", []):
+                index = led.get("i", -1)
+                if 0 <= index < self.led_count:
+                    self.pixels[index] = (led.get("r", 0) << 16) | (led.get("g", 0) << 8) | led.get("b", 0)
+        self.publish_status()
+
+    def _frame_complete(self, sequence: int):
+        sent = self.stats['frame_sent'].get(sequence)
+        if sent is not None:
+            received = time.perf_counter()
+            self.stats['frame_latencies'].append(received - sent)
+            self.stats['frame_received'].setdefault(sequence, []).append(received)
+
+
+def load_frames(path: str) -> List[Dict[int, tuple]]:
+    """Load recorded frames: one JSON object per line mapping LED index to [r, g, b]."""
+    frames = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                frames.append({int(led): tuple(rgb) for led, rgb in json.loads(line).items()})
+    return frames
+
+
+def synthetic_frames(count: int, route_leds: int = 41) -> List[Dict[int, tuple]]:
+    """Trains hopping along the route LEDs, like main.py's output."""
+    frames = []
+    for n in range(count):
+        frame = {led: (0, 0, 0) for led in range(route_leds)}
+        for train in range(12):
+            frame[(train * 7 + n) % route_leds] = (255, 0, 0) if train % 2 else (0, 0, 255)
+        frames.append(frame)
+    return frames
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def current_rss_mb() -> float:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+async def run_fleet(num_boards: int, frames: List[Dict[int, tuple]], fps: float,
+                    heartbeat_interval: float, broker_host: str = None, broker_port: int = None,
+                    num_connections: int = 1, connection_rate: float = None, led_count: int = LED_COUNT,
+                    advertise: bool = True) -> Dict:
+    broker = None
+    if broker_host is None:
+        broker = await LocalBroker(publish_rate_limit=connection_rate).start()
+        broker_host, broker_port = broker.host, broker.port
+
+    stats = {'messages': 0, 'overflows': 0, 'parse_errors': 0, 'frame_sent': {}, 'frame_latencies': [],
+             'frame_received': {}}
+    boards = [SimulatedBoard(f"{i:012X}", heartbeat_interval, stats, led_count, advertise) for i in range(num_boards)]
+    await asyncio.gather(*(board.start(broker_host, broker_port) for board in boards))
+
+    db_dir = tempfile.mkdtemp(prefix="led_load_test_")
+    controller = SimpleLEDController(broker_ip=broker_host, broker_port=broker_port,
+                                     db_path=os.path.join(db_dir, "led_boards.db"),
+                                     num_connections=num_connections)
+    controller.set_board("main", send_to_all=True)
+
+    # Time heartbeat DB writes as they happen on paho's network thread
+    db_latencies = []
+    update_heartbeat = controller._update_board_heartbeat
+
+    def timed_update(board_id, status):
+        start = time.perf_counter()
+        update_heartbeat(board_id, status)
+        db_latencies.append(time.perf_counter() - start)
+
+    controller._update_board_heartbeat = timed_update
+
+    # Wait for every board's heartbeat so the controller knows where to send
+    deadline = time.monotonic() + heartbeat_interval * 2 + 5
+    while len(controller.get_active_boards()) < num_boards and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    registered = len(controller.get_active_boards())
+
+    controller.publish_counts = [0] * len(controller.clients)
+
+    def drive():
+        interval = 1.0 / fps
+        next_frame = time.perf_counter()
+        marker_led = led_count - 1
+        for sequence, frame in enumerate(frames, start=1):
+            colors = dict(frame)
+            colors.pop(marker_led, None)
+            colors[marker_led] = ((sequence >> 16) & 0xFF, (sequence >> 8) & 0xFF, sequence & 0xFF)
+            stats['frame_sent'][sequence] = time.perf_counter()
+            controller.set_multiple_leds(colors)
+            next_frame += interval
+            time.sleep(max(0.0, next_frame - time.perf_counter()))
+
+    start = time.perf_counter()
+    await asyncio.to_thread(drive)
+    drive_elapsed = time.perf_counter() - start
+
+    # Let in-flight frames land
+    expected = len(frames) * registered
+    deadline = time.monotonic() + 10
+    while len(stats['frame_latencies']) < expected and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    total_elapsed = time.perf_counter() - start
+
+    rss = current_rss_mb()
+    connection_stats = controller.get_connection_stats()
+    for client in controller.clients:
+        client.disconnect()
+        client.loop_stop()
+    await asyncio.gather(*(board.stop() for board in boards))
+    if broker is not None:
+        await broker.stop()
+
+    latencies = stats['frame_latencies']
+    # Time between the first and the last board showing each frame
+    spreads = [max(received) - min(received) for received in stats['frame_received'].values()]
+    publishes = sum(controller.publish_counts)
+    return {
+        'boards': num_boards,
+        'leds': led_count,
+        'connections': len(controller.clients),
+        'registered': registered,
+        'publishes': publishes,
+        'publish_rate': publishes / drive_elapsed if drive_elapsed else 0.0,
+        'messages_per_frame': publishes / (len(frames) * registered) if registered else 0.0,
+        'connection_rates': [c['publishes'] / drive_elapsed if drive_elapsed else 0.0 for c in connection_stats],
+        'connection_boards': [c['boards'] for c in connection_stats],
+        'frames_delivered': len(latencies),
+        'frames_expected': expected,
+        'latency_p50_ms': percentile(latencies, 50) * 1000,
+        'latency_p95_ms': percentile(latencies, 95) * 1000,
+        'latency_p99_ms': percentile(latencies, 99) * 1000,
+        'spread_p50_ms': percentile(spreads, 50) * 1000,
+        'spread_p95_ms': percentile(spreads, 95) * 1000,
+        'db_write_p50_ms': percentile(db_latencies, 50) * 1000,
+        'db_write_p95_ms': percentile(db_latencies, 95) * 1000,
+        'db_writes': len(db_latencies),
+        'overflows': stats['overflows'],
+        'rss_mb': rss,
+        'elapsed_s': total_elapsed,
+    }
+
+
+def print_report(results: List[Dict]):
+    header = (f"{'boards':>7} {'leds':>5} {'conn':>5} {'reg':>5} {'pub/s':>9} {'msg/frm':>8} {'delivered':>11} "
+              f"{'p50 ms':>8} {'p95 ms':>8} "
+              f"{'p99 ms':>8} {'spr p50':>8} {'spr p95':>8} {'db p50':>7} {'db p95':>7} {'ovf':>4} {'RSS MB':>7}")
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['boards']:>7} {r['leds']:>5} {r['connections']:>5} {r['registered']:>5} {r['publish_rate']:>9.0f} "
+              f"{r['messages_per_frame']:>8.1f} "
+              f"{r['frames_delivered']:>5}/{r['frames_expected']:<5} {r['latency_p50_ms']:>8.1f} "
+              f"{r['latency_p95_ms']:>8.1f} {r['latency_p99_ms']:>8.1f} {r['spread_p50_ms']:>8.1f} "
+              f"{r['spread_p95_ms']:>8.1f} {r['db_write_p50_ms']:>7.2f} "
+              f"{r['db_write_p95_ms']:>7.2f} {r['overflows']:>4} {r['rss_mb']:>7.1f}")
+
+    print()
+    print("Per-connection publishes/s (boards):")
+    for r in results:
+        rates = ' '.join(f"{rate:.0f}({boards})" for rate, boards in zip(r['connection_rates'], r['connection_boards']))
+        print(f"{r['boards']:>7} boards, {r['connections']:>2} conn: {rates}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Load test SimpleLEDController against a simulated board fleet")
+    parser.add_argument("--boards", default="10,50,100,200", help="Comma-separated fleet sizes to test")
+    parser.add_argument("--frames", type=int, default=50, help="Number of synthetic frames per run")
+    parser.add_argument("--frames-file", help="Recorded frames (JSON lines of {led: [r, g, b]})")
+    parser.add_argument("--fps", type=float, default=5, help="Frame rate the controller is driven at")
+    parser.add_argument("--heartbeat", type=float, default=2, help="Simulated heartbeat interval (seconds)")
+    parser.add_argument("--broker", help="host:port of an external broker (default: in-process)")
+    parser.add_argument("--connections", default="1", help="Comma-separated controller connection pool sizes")
+    parser.add_argument("--connection-rate", type=float,
+                        help="Per-connection publish limit of the in-process broker (messages/s)")
+    parser.add_argument("--leds", default=str(LED_COUNT), help="Comma-separated strip lengths of the boards")
+    parser.add_argument("--legacy", action="store_true",
+                        help="Boards run older firmware that does not advertise its layout")
+    args = parser.parse_args()
+
+    host, port = (args.broker.split(':')[0], int(args.broker.split(':')[1])) if args.broker else (None, None)
+
+    results = []
+    for led_count in [int(n) for n in args.leds.split(',')]:
+        # The route takes the same share of a longer strip (41 of 45 LEDs on the standard board)
+        frames = (load_frames(args.frames_file) if args.frames_file
+                  else synthetic_frames(args.frames, led_count * 41 // LED_COUNT))
+        for num_boards in [int(n) for n in args.boards.split(',')]:
+            for num_connections in [int(n) for n in args.connections.split(',')]:
+                print(f"Running {num_boards} boards of {led_count} LEDs over {num_connections} connection(s), "
+                      f"{len(frames)} frames at {args.fps} fps...")
+                results.append(await run_fleet(num_boards, frames, args.fps, args.heartbeat, host, port,
+                                               num_connections, args.connection_rate, led_count, not args.legacy))
+    print()
+    print_report(results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
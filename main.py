@@ -1,77 +1,155 @@
-from SimpleLEDController import SimpleLEDController
+from AsyncLEDController import AsyncLEDController
 from ValleyMetroTracker import ValleyMetroTracker
+from PositionStore import PositionStore
+from StationETA import StationETA
+from Profiler import Profiler
+from StateCheckpoint import StateCheckpoint
+from LiveMapServer import LiveMapServer
+import argparse
 import asyncio
+import time
 
-async def main():
-    # Create instance of LED controller
-    controller = SimpleLEDController()
-    
-    # Wait for connection
-    await asyncio.sleep(2)
+GTFS_URL = "https://app.mecatran.com/utw/ws/gtfsfeed/vehicles/valleymetro?apiKey=4f22263f69671d7f49726c3011333e527368211f"
+
+
+def direction_stations(closest_stations):
+    """LED_IDs with a westbound train and LED_IDs with any other train."""
+    west_stations = {station['LED_ID'] for station in closest_stations if station['direction'] == 'westbound'}
+    east_stations = {station['LED_ID'] for station in closest_stations if station['direction'] != 'westbound'}
+    return west_stations, east_stations
+
+
+def led_colors_for(leds, west_stations, east_stations):
+    """Color of each of the given LEDs for the trains at its station."""
+    led_colors = {}
+    for station_num in sorted(leds):
+        if station_num in west_stations and station_num in east_stations:
+            led_colors[station_num] = (255, 0, 255)  # Purple
+        elif station_num in west_stations:
+            led_colors[station_num] = (255, 0, 0)  # Red
+        elif station_num in east_stations:
+            led_colors[station_num] = (0, 0, 255)  # Blue
+        else:
+            led_colors[station_num] = (0, 0, 0)  # No trains, off
+    return led_colors
+
+
+async def main(map_host="0.0.0.0", map_port=8080):
+    launched = time.monotonic()
+
+    # Create instance of LED controller (connects in connect_mqtt below)
+    controller = AsyncLEDController()
     
     # Set the board ID (replace with your actual board ID)
     controller.set_board("main",send_to_all=True)
-    
-    # Set up the tracker
-    tracker = ValleyMetroTracker(
-        stations_csv='stations.csv',
-        gtfs_url="https://app.mecatran.com/utw/ws/gtfsfeed/vehicles/valleymetro?apiKey=4f22263f69671d7f49726c3011333e527368211f"
-    )
-    
-    # Start the tracker in the background
-    # tracker_task = asyncio.create_task(tracker.start_tracker())
+
+    # Profiling on demand: SIGUSR1/SIGUSR2 or a message on the controller's profile topic
+    profiler = Profiler("profiles", loop=asyncio.get_running_loop())
+    profiler.install_signal_handlers()
+    controller.profiler = profiler
+
+    # Warm restart: last train snapshot, active boards and the frame each board was showing
+    checkpoint = StateCheckpoint("runtime_state.json.gz")
+    saved = checkpoint.load()
+    if saved is not None:
+        controller.restore_state(saved['controller'])
+
+    # Browser map at http://<map_host>:<map_port>/, fed from the same fetch as the LEDs
+    live_map = LiveMapServer(host=map_host, port=map_port)
+
+    async def connect_mqtt():
+        await controller.start()
+        try:
+            await controller.connected(timeout=30)
+        except asyncio.TimeoutError:
+            print("MQTT broker did not answer, continuing without it")
+            return
+        if saved is not None and controller.last_frames:
+            # Show the last frame while the first live fetch is still running
+            await controller.replay_last_frames()
+            print(f"Restored frame from {time.time() - saved['saved_at']:.0f}s ago on "
+                  f"{len(controller.last_frames)} board(s), {time.monotonic() - launched:.2f}s after launch")
+
+    async def start_tracker():
+        # Station table and travel-time matrix are file I/O, keep them off the event loop
+        tracker = await asyncio.to_thread(ValleyMetroTracker, 'stations.csv', GTFS_URL, PositionStore("history"))
+        # Learn inter-station travel times and keep next-arrival predictions current
+        eta = await asyncio.to_thread(StationETA, tracker, "travel_times.npy")
+        # A checkpoint written before the first good fetch has no snapshot worth restoring
+        if saved is not None and saved['tracker']['last_good_time'] is not None:
+            tracker.restore_state(saved['tracker'])
+            tracker.replay_events()  # Seeds StationETA with the restored trains
+            print(f"Restored {len(tracker.train_locations)} trains from {tracker.get_snapshot_age():.0f}s ago")
+        try:
+            await live_map.start(tracker)
+        except OSError as e:
+            # The map is optional: keep driving the LEDs without it (publish() then reaches no viewers)
+            print(f"Live map not started on {map_host}:{map_port}: {str(e)}")
+        live_map.publish(tracker)  # Restored trains, if any
+        with profiler.stage('fetch_train_data'):
+            await tracker.fetch_train_data()
+        tracker.report_update()
+        live_map.publish(tracker)
+        return tracker, eta
+
     print("Starting Valley Metro train tracker...")
+    # Connect MQTT, load stations and do the first fetch concurrently
+    try:
+        _, (tracker, eta) = await asyncio.gather(connect_mqtt(), start_tracker())
+    except Exception:
+        # Startup failed before the main loop's cleanup below is in place
+        await controller.stop()
+        await live_map.stop()
+        raise
+    first_frame = True
     
     try:
         while True:
-            await asyncio.sleep(5)
-            await tracker.run_tracker()
-            closest_stations = tracker.get_train_closest_stations()
-            west_bound_stations = []
-            east_bound_stations = []
-            
-            for station in closest_stations:
-                if station['direction'] == 'westbound':
-                    west_bound_stations.append(station)
-                else:
-                    east_bound_stations.append(station)
-
-            west_stations = {station['LED_ID'] for station in west_bound_stations}
-            east_stations = {station['LED_ID'] for station in east_bound_stations}
+            # A board that appeared, changed its strip, rebooted or timed out may not show its last
+            # frame: forget it, so the board is sent everything
+            for board_id in controller.pop_new_layouts():
+                controller.last_frames.pop(board_id, None)
+            with profiler.stage('get_train_closest_stations'):
+                closest_stations = tracker.get_train_closest_stations()
+            west_stations, east_stations = direction_stations(closest_stations)
 
             print("West-bound stations:", west_stations)
             print("East-bound stations:", east_stations)
-            
-            both_directions = west_stations.intersection(east_stations)
-            for station_num in both_directions:
-                controller.set_led(station_num, 255, 0, 255)  # Purple
-
-            west_only = west_stations - east_stations
-            for station_num in west_only:
-                controller.set_led(station_num, 255, 0, 0)  # Red
-
-            east_only = east_stations - west_stations
-            for station_num in east_only:
-                controller.set_led(station_num, 0, 0, 255)  # Blue
-
-            # for all other stations (0-40) with no trains set to off 
-            for i in range(41):
-                if i not in both_directions and i not in west_only and i not in east_only:
-                    controller.set_led(i, 0, 0, 0)
+
+            # The full frame every cycle, but each board is only sent the LEDs that differ from its
+            # last frame, so a board that timed out between heartbeats catches up once it is back
+            led_colors = led_colors_for(controller.get_led_numbers(), west_stations, east_stations)
+
+            with profiler.stage('publish'):
+                await controller.update_leds(led_colors, only_changed=True)
+            if first_frame:
+                print(f"First frame sent {time.monotonic() - launched:.2f}s after launch")
+                first_frame = False
+
+            with profiler.stage('checkpoint'):
+                checkpoint.maybe_save(tracker, controller)
+
+            await asyncio.sleep(tracker.update_interval)
+            with profiler.stage('fetch_train_data'):
+                await tracker.fetch_train_data()
+            tracker.report_update()
+            live_map.publish(tracker)
                 
     except Exception as e:
         print(f"Error: {e}")
     except KeyboardInterrupt:
         print("\nExiting...")
     finally:
-        # Cancel the tracker task
-        tracker_task.cancel()
-        try:
-            await tracker_task
-        except asyncio.CancelledError:
-            pass
-        controller.client.loop_stop()
-        controller.set_all_off()
+        tracker.position_store.flush()
+        eta.save()
+        checkpoint.save(tracker, controller)  # Before the LEDs are switched off below
+        await controller.update_all(0, 0, 0)
+        await controller.stop()
+        await live_map.stop()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Valley Metro train tracker for the LED map")
+    parser.add_argument("--map-host", default="0.0.0.0", help="Address the live browser map listens on")
+    parser.add_argument("--map-port", type=int, default=8080, help="Port of the live browser map")
+    args = parser.parse_args()
+    asyncio.run(main(args.map_host, args.map_port))
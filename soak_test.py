@@ -0,0 +1,345 @@
+import argparse
+import asyncio
+import contextlib
+import gc
+import glob
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+from aiohttp import web
+from google.transit import gtfs_realtime_pb2
+
+from AsyncLEDController import AsyncLEDController
+from LocalBroker import LocalBroker
+from PositionStore import PositionStore
+from StationETA import StationETA
+from ValleyMetroTracker import ValleyMetroTracker
+from load_test import SimulatedBoard, current_rss_mb, percentile
+from main import direction_stations, led_colors_for
+
+# Metrics checked for drift: sample key -> (label, unit)
+DRIFT_METRICS = {
+    'rss_mb': ('RSS', 'MB'),
+    'heap_mb': ('Python heap (tracemalloc)', 'MB'),
+    'db_mb': ('Heartbeat SQLite file', 'MB'),
+    'latency_ms': ('Cycle latency (mean)', 'ms'),
+    'paho_queue': ('Paho outgoing queue', 'packets'),
+}
+
+
+class SyntheticRailFeed:
+    """
+    Light rail trains running end to end along stations.csv at roughly 30 km/h, on a simulated
+    clock that advances one update interval per feed. Trains finishing a run are replaced by new
+    ones with new IDs, as trips do through a service day, plus some buses the tracker filters out.
+    """
+
+    def __init__(self, stations_df: pd.DataFrame, interval: float, num_trains=16, num_buses=200, seed=0):
+        positions = stations_df.groupby('LED_ID')[['POINT_Y', 'POINT_X']].mean().sort_index()
+        self.lats = positions['POINT_Y'].to_numpy()
+        self.lons = positions['POINT_X'].to_numpy()
+        self.interval = interval
+        self.num_buses = num_buses
+        self.rng = random.Random(seed)
+        self.clock = time.time()
+        self.next_id = 0
+        self.trains = [self._new_train(self.rng.uniform(0, len(self.lats) - 1)) for _ in range(num_trains)]
+
+    def _new_train(self, position=None) -> List:
+        direction = self.rng.choice((1, -1))
+        if position is None:
+            position = 0.0 if direction > 0 else len(self.lats) - 1.0
+        self.next_id += 1
+        speed = self.rng.uniform(1 / 200, 1 / 100)  # Stations per second
+        return [f"{self.next_id:04d}", position, direction, speed]
+
+    def _coords(self, position: float):
+        i = min(int(position), len(self.lats) - 2)
+        frac = position - i
+        return (self.lats[i] + (self.lats[i + 1] - self.lats[i]) * frac,
+                self.lons[i] + (self.lons[i + 1] - self.lons[i]) * frac)
+
+    def __call__(self) -> bytes:
+        self.clock += self.interval
+        for index, train in enumerate(self.trains):
+            train[1] += train[2] * train[3] * self.interval
+            if not 0 <= train[1] <= len(self.lats) - 1:
+                self.trains[index] = self._new_train()
+
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.header.gtfs_realtime_version = '2.0'
+        feed.header.timestamp = int(self.clock)
+        for train_id, position, direction, _ in self.trains:
+            if self.rng.random() < 0.02:
+                continue  # Missing from this feed, as vehicles sometimes are
+            entity = feed.entity.add()
+            entity.id = train_id
+            vehicle = entity.vehicle
+            vehicle.vehicle.id = train_id
+            vehicle.trip.route_id = 'RAIL'
+            vehicle.trip.trip_id = f"RAIL-{train_id}-{'EAST' if direction > 0 else 'WEST'}"
+            vehicle.position.latitude, vehicle.position.longitude = self._coords(position)
+            vehicle.timestamp = int(self.clock)
+        for bus in range(self.num_buses):
+            entity = feed.entity.add()
+            entity.id = f"B{bus}"
+            entity.vehicle.vehicle.id = f"B{bus}"
+            entity.vehicle.trip.route_id = str(bus % 50)
+            entity.vehicle.position.latitude = 33.4 + self.rng.random() * 0.2
+            entity.vehicle.position.longitude = -112.2 + self.rng.random() * 0.4
+            entity.vehicle.timestamp = int(self.clock)
+        return feed.SerializeToString()
+
+
+class RecordedFeeds:
+    """Recorded feed files (*.pb), replayed in name order and looped."""
+
+    def __init__(self, directory: str):
+        self.paths = sorted(glob.glob(os.path.join(directory, '*.pb')))
+        if not self.paths:
+            raise ValueError(f"No .pb files in {directory}")
+        self.index = 0
+
+    def __call__(self) -> bytes:
+        with open(self.paths[self.index % len(self.paths)], 'rb') as f:
+            self.index += 1
+            return f.read()
+
+
+def file_size_mb(*paths: str) -> float:
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path)) / 1e6
+
+
+def slope_per_day(samples: List[Dict], key: str) -> float:
+    """Least-squares growth rate of a sampled metric per simulated day."""
+    days = np.array([sample['sim_days'] for sample in samples])
+    values = np.array([sample[key] for sample in samples], dtype=float)
+    if len(samples) < 2 or np.ptp(days) == 0:
+        return 0.0
+    return float(np.polyfit(days, values, 1)[0])
+
+
+async def run_soak(args) -> Dict:
+    work_dir = tempfile.mkdtemp(prefix="soak_test_")
+    db_path = os.path.join(work_dir, "led_boards.db")
+    stations_df = pd.read_csv(args.stations)
+    source = RecordedFeeds(args.feeds) if args.feeds else SyntheticRailFeed(stations_df, args.interval)
+
+    # Local stand-ins for the GTFS endpoint and the MQTT broker. Each cycle's feed is built
+    # before the cycle is timed, so only the tracker's work counts toward its latency.
+    current_feed = [b'']
+
+    async def serve_feed(request):
+        return web.Response(body=current_feed[0])
+
+    app = web.Application()
+    app.router.add_get('/', serve_feed)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    feed_url = f"http://127.0.0.1:{runner.addresses[0][1]}/"
+    broker = await LocalBroker().start()
+
+    # The same pipeline main.py runs
+    tracker = ValleyMetroTracker(args.stations, feed_url, PositionStore(os.path.join(work_dir, "history")))
+    eta = StationETA(tracker)
+    controller = AsyncLEDController(broker.host, broker.port, db_path=db_path)
+    await controller.start()
+    await controller.connected(timeout=10)
+    controller.set_board("main", send_to_all=True)
+
+    stats = {'messages': 0, 'overflows': 0, 'parse_errors': 0, 'frame_sent': {}, 'frame_latencies': [],
+             'frame_received': {}}
+    # Heartbeats are driven per cycle below, on the simulated clock
+    boards = [SimulatedBoard(f"{i:012X}", math.inf, stats) for i in range(args.boards)]
+    await asyncio.gather(*(board.start(broker.host, broker.port) for board in boards))
+
+    cycles = int(args.days * 86400 / args.interval)
+    sample_every = max(1, cycles // args.samples)
+    heartbeat_every = max(1, round(args.heartbeat / args.interval))
+    warmup_cycles = int(cycles * args.warmup)
+    # Keep as much heartbeat history as the warmup produces, so the retention limit is reached
+    # before the slopes start and the measured window sees the pruned steady state
+    controller.history_rows_per_board = max(1, warmup_cycles // heartbeat_every)
+
+    tracemalloc.start(args.traceback_depth)
+    baseline = None
+    baseline_cycle = cycles  # First cycle counted toward the slopes
+    samples = []
+    window = []
+    started = time.perf_counter()
+
+    for cycle in range(cycles):
+        # Boards booted at different times: spread their heartbeats over the interval
+        for index, board in enumerate(boards):
+            if (cycle + index * heartbeat_every // len(boards)) % heartbeat_every == 0:
+                board.publish_heartbeat()
+
+        current_feed[0] = source()
+        start = time.perf_counter()
+        await tracker.fetch_train_data()
+        for board_id in controller.pop_new_layouts():
+            controller.last_frames.pop(board_id, None)
+        west_stations, east_stations = direction_stations(tracker.get_train_closest_stations())
+        led_colors = led_colors_for(controller.get_led_numbers(), west_stations, east_stations)
+        await controller.update_leds(led_colors, only_changed=True)
+        eta.get_station_etas()
+        window.append(time.perf_counter() - start)
+
+        # Let the broker and boards catch up, as they would during the real update interval
+        await asyncio.sleep(args.pause)
+
+        if cycle + 1 == warmup_cycles or (cycle + 1) % sample_every == 0:
+            # Drop buffered positions and uncollected reference cycles (aiohttp leaves a few per
+            # request) so samples compare retained memory rather than where in a sawtooth they land
+            tracker.position_store.flush()
+            gc.collect()
+        if cycle + 1 == warmup_cycles:
+            baseline = tracemalloc.take_snapshot()
+            baseline_cycle = cycle + 1
+        if (cycle + 1) % sample_every == 0:
+            samples.append({
+                'cycle': cycle + 1,
+                'sim_days': (cycle + 1) * args.interval / 86400,
+                'rss_mb': current_rss_mb() - tracemalloc.get_tracemalloc_memory() / 1e6,
+                'heap_mb': tracemalloc.get_traced_memory()[0] / 1e6,
+                'db_mb': file_size_mb(db_path, db_path + '-journal', db_path + '-wal'),
+                'history_mb': sum(file_size_mb(path) for path in glob.glob(os.path.join(work_dir, "history", "*"))),
+                'latency_ms': sum(window) / len(window) * 1000,
+                'latency_p95_ms': percentile(window, 95) * 1000,
+                'paho_queue': sum(len(client._out_packet) for client in controller.clients),
+                'publish_waiters': len(controller._publish_waiters),
+                'trains': len(tracker.train_states),
+                'station_cache': len(tracker.station_cache),
+                'active_boards': len(controller.get_active_boards()),
+            })
+            window = []
+            if args.progress:
+                sample = samples[-1]
+                print(f"day {sample['sim_days']:6.2f}  RSS {sample['rss_mb']:7.1f} MB  heap {sample['heap_mb']:6.2f} MB  "
+                      f"db {sample['db_mb']:6.3f} MB  cycle {sample['latency_ms']:6.2f} ms", file=sys.__stdout__)
+
+    elapsed = time.perf_counter() - started
+    tracker.position_store.flush()
+    gc.collect()
+    final = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    await controller.stop()
+    await asyncio.gather(*(board.stop() for board in boards))
+    await broker.stop()
+    await runner.cleanup()
+
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>")]
+    top = []
+    if baseline is not None:
+        top = final.filter_traces(ignore).compare_to(baseline.filter_traces(ignore), 'traceback')[:args.top]
+
+    measured = [sample for sample in samples if sample['cycle'] > baseline_cycle]
+    return {
+        'cycles': cycles,
+        'elapsed_s': elapsed,
+        'samples': samples,
+        'slopes': {key: slope_per_day(measured, key) for key in DRIFT_METRICS},
+        'measured_samples': len(measured),
+        'top_allocators': top,
+        'messages': stats['messages'],
+        'work_dir': work_dir,
+    }
+
+
+def print_report(result: Dict, limits: Dict[str, float]) -> bool:
+    """Print the soak test report; returns True if every drift is within its limit."""
+    samples = result['samples']
+    first, last = samples[0], samples[-1]
+    print(f"\n{result['cycles']} cycles ({last['sim_days']:.2f} simulated days) in {result['elapsed_s']:.0f}s, "
+          f"{result['messages']} control messages delivered")
+    print(f"Trains tracked {last['trains']}, station cache {last['station_cache']}, "
+          f"active boards {last['active_boards']}, publish waiters {last['publish_waiters']}, "
+          f"position history {last['history_mb']:.2f} MB, work dir {result['work_dir']}")
+
+    if result['measured_samples'] < 2:
+        print("\nThe run ended before warmup was over; nothing measured, increase --days\nFAIL")
+        return False
+
+    print(f"\n{'metric':<28} {'first':>10} {'last':>10} {'slope/day':>11} {'limit':>9}")
+    passed = True
+    for key, (label, unit) in DRIFT_METRICS.items():
+        slope = result['slopes'][key]
+        limit = limits[key]
+        ok = slope <= limit
+        passed &= ok
+        print(f"{label:<28} {first[key]:>10.3f} {last[key]:>10.3f} {slope:>+11.3f} {limit:>9.3f} {unit:<8}"
+              f"{'' if ok else 'FAIL'}")
+    print(f"Cycle latency p95 (last sample): {last['latency_p95_ms']:.2f} ms")
+
+    if result['top_allocators']:
+        print("\nTop allocation growth since warmup:")
+        for stat in result['top_allocators']:
+            frames = [f"{os.path.join(*frame.filename.split(os.sep)[-2:])}:{frame.lineno}" for frame in stat.traceback]
+            print(f"  {stat.size_diff / 1024:>+9.1f} KB {stat.count_diff:>+7} blocks  {frames[0]}")
+            for frame in frames[1:]:
+                print(f"  {'':>30}{frame}")
+    print(f"\n{'PASS' if passed else 'FAIL'}")
+    return passed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Soak test the tracker and LED controller at accelerated speed")
+    parser.add_argument("--days", type=float, default=1, help="Simulated days to run")
+    parser.add_argument("--interval", type=float, default=5, help="Simulated seconds per update cycle")
+    parser.add_argument("--feeds", help="Directory of recorded feeds (*.pb) to loop (default: synthetic)")
+    parser.add_argument("--stations", default="stations.csv")
+    parser.add_argument("--boards", type=int, default=5, help="Simulated boards")
+    parser.add_argument("--heartbeat", type=float, default=100, help="Simulated heartbeat interval (seconds)")
+    parser.add_argument("--pause", type=float, default=0.0, help="Real seconds to yield between cycles")
+    parser.add_argument("--samples", type=int, default=50, help="Samples over the run")
+    parser.add_argument("--warmup", type=float, default=0.1, help="Fraction of the run excluded from slopes")
+    parser.add_argument("--top", type=int, default=10, help="Allocation sites to report")
+    parser.add_argument("--traceback-depth", type=int, default=1, help="tracemalloc frames per allocation")
+    parser.add_argument("--progress", action="store_true", help="Print each sample as it is taken")
+    parser.add_argument("--verbose", action="store_true", help="Keep the tracker and controller output")
+    parser.add_argument("--max-rss-slope", type=float, default=5.0, help="MB per simulated day")
+    parser.add_argument("--max-heap-slope", type=float, default=1.0, help="MB per simulated day")
+    # Low enough to catch unbounded heartbeat_history growth (about 0.5 MB/day with 5 boards)
+    parser.add_argument("--max-db-slope", type=float, default=0.1, help="MB per simulated day")
+    parser.add_argument("--max-latency-slope", type=float, default=2, help="ms per simulated day")
+    parser.add_argument("--max-queue-slope", type=float, default=10, help="Packets per simulated day")
+    parser.add_argument("--min-measured-days", type=float, default=0.25,
+                        help="Shortest simulated span after warmup that a slope is fit over")
+    parser.add_argument("--min-measured-samples", type=int, default=10, help="Fewest samples a slope is fit over")
+    args = parser.parse_args()
+
+    # Over a shorter span the slopes are mostly sampling noise (SQLite page allocation, GC timing)
+    measured_days = args.days * (1 - args.warmup)
+    if measured_days < args.min_measured_days:
+        parser.error(f"only {measured_days:.3f} simulated days after warmup, need {args.min_measured_days}; "
+                     f"increase --days")
+    if int(args.samples * (1 - args.warmup)) < args.min_measured_samples:
+        parser.error(f"only about {int(args.samples * (1 - args.warmup))} samples after warmup, "
+                     f"need {args.min_measured_samples}; increase --samples")
+
+    limits = {
+        'rss_mb': args.max_rss_slope,
+        'heap_mb': args.max_heap_slope,
+        'db_mb': args.max_db_slope,
+        'latency_ms': args.max_latency_slope,
+        'paho_queue': args.max_queue_slope,
+    }
+    print(f"Soaking {args.days} simulated days of {args.interval}s cycles with {args.boards} boards...")
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+        result = await run_soak(args)
+    return 0 if print_report(result, limits) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
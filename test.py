@@ -3,9 +3,117 @@ from tkinter import ttk, colorchooser
 import paho.mqtt.client as mqtt
 import json
 import colorsys
-import threading
 import time
-from typing import List, Dict
+from collections import OrderedDict
+from typing import Callable, List, Dict, Optional
+
+from SimpleLEDController import chunk_leds_hex, encode_message
+
+
+class AnimationScheduler:
+    """
+    Single owner of every running LED pattern.
+    Patterns are composed over the static LED state into one frame, and only LEDs that
+    changed since the last published frame are sent (compact "leds_hex" format).
+    Frames go out from the Tk event loop at most max_fps times per second; any number of
+    changes between two frames are coalesced into the next one.
+    """
+
+    def __init__(self, root, publish: Callable[[Dict], None], num_leds: int, max_fps: float = 20,
+                 max_payload: int = 200):
+        self.root = root
+        self.publish = publish
+        self.num_leds = num_leds
+        self.max_fps = max_fps
+        # Encoded bytes per message: PubSubClient's 256 byte packet minus header, topic length and topic
+        self.max_payload = max_payload
+        self.base = [(0, 0, 0)] * num_leds  # Static state set by toggles / all on / all off / rainbow
+        self.patterns = OrderedDict()  # name -> (pattern, step_interval, started)
+        self.sent: List[Optional[tuple]] = [None] * num_leds  # Last frame published, None = unknown
+        self.brightness = None
+        self.sent_brightness = None
+        self.last_frame_time = 0.0
+        self._pending = None  # Tk after() id of the next scheduled frame
+
+    def set_led(self, led_num: int, color: tuple):
+        self.base[led_num] = color
+        self.request_frame()
+
+    def set_all(self, colors: List[tuple]):
+        self.base = list(colors)
+        self.request_frame()
+
+    def set_brightness(self, brightness: int):
+        self.brightness = brightness
+        self.request_frame()
+
+    def start_pattern(self, name: str, pattern: Callable[[int], Dict[int, tuple]], step_interval: float):
+        """
+        Start (or replace) a named pattern. pattern(step) returns {led: (r, g, b)} drawn over
+        the static state; step advances every step_interval seconds.
+        """
+        self.patterns[name] = (pattern, step_interval, time.monotonic())
+        self.request_frame()
+
+    def stop_pattern(self, name: str):
+        if self.patterns.pop(name, None) is not None:
+            self.request_frame()
+
+    def stop_all(self):
+        self.patterns.clear()
+        self.request_frame()
+
+    def invalidate(self):
+        """Forget what was last published, e.g. after switching boards, so the next frame is complete."""
+        self.sent = [None] * self.num_leds
+        self.sent_brightness = None
+        self.request_frame()
+
+    def set_max_fps(self, max_fps: float):
+        self.max_fps = max(0.1, max_fps)
+
+    def request_frame(self):
+        """Schedule the next frame as soon as the frame rate allows (coalesces repeated requests)."""
+        if self._pending is not None:
+            return
+        delay = self.last_frame_time + 1.0 / self.max_fps - time.monotonic()
+        self._pending = self.root.after(max(0, int(delay * 1000)), self._frame)
+
+    def compose(self) -> List[tuple]:
+        frame = list(self.base)
+        now = time.monotonic()
+        for pattern, step_interval, started in self.patterns.values():
+            step = int((now - started) / step_interval)
+            for led_num, color in pattern(step).items():
+                if 0 <= led_num < self.num_leds:
+                    frame[led_num] = color
+        return frame
+
+    def _frame(self):
+        self._pending = None
+        self.last_frame_time = time.monotonic()
+
+        frame = self.compose()
+        changed = [(i, "%02X%02X%02X" % color) for i, color in enumerate(frame) if self.sent[i] != color]
+        brightness_changed = self.brightness is not None and self.brightness != self.sent_brightness
+
+        messages = self.chunk(changed, self.brightness if brightness_changed else None)
+
+        for message in messages:
+            self.publish(message)
+        self.sent = frame
+        if brightness_changed:
+            self.sent_brightness = self.brightness
+
+        if self.patterns:
+            self.request_frame()
+
+    def chunk(self, changed: List[tuple], brightness: Optional[int] = None) -> List[Dict]:
+        """Messages for the changed (led_num, hex color) pairs, sized like the controller's;
+        a changed brightness rides along in each of them."""
+        extra = {} if brightness is None else {"brightness": brightness}
+        return chunk_leds_hex(changed, self.max_payload, extra) or ([extra] if extra else [])
+
 
 class LEDController:
     def __init__(self):
@@ -22,6 +130,9 @@ class LEDController:
         self.selected_color = "#FF0000"  # Default red
         self.led_states = [False] * self.num_leds  # Track LED states
         self.brightness = tk.IntVar(value=50)  # Default brightness
+        self.max_fps = tk.DoubleVar(value=20)  # Max frames per second sent to the broker
+        self.animations = AnimationScheduler(self.root, self.publish_message, self.num_leds,
+                                             max_fps=self.max_fps.get())
         
         # Initialize MQTT client with protocol v5
         self.client = mqtt.Client(protocol=mqtt.MQTTv5)
@@ -70,6 +181,13 @@ class LEDController:
                   command=self.chase_pattern).pack(side='left', padx=5)
         ttk.Button(control_frame, text="Rainbow", 
                   command=self.rainbow_pattern).pack(side='left', padx=5)
+        ttk.Button(control_frame, text="Stop", 
+                  command=self.stop_patterns).pack(side='left', padx=5)
+
+        # Frame rate limit
+        ttk.Label(control_frame, text="Max FPS:").pack(side='left')
+        ttk.Spinbox(control_frame, from_=1, to=60, width=4, textvariable=self.max_fps,
+                    command=self.on_max_fps_change).pack(side='left', padx=5)
         
         # LED Grid
         self.led_frame = ttk.Frame(self.root)
@@ -82,7 +200,13 @@ class LEDController:
     def on_brightness_change(self, value):
         # Update brightness for current state
         if self.current_board.get():
-            self.publish_message({"brightness": self.brightness.get()})
+            self.animations.set_brightness(self.brightness.get())
+
+    def on_max_fps_change(self):
+        try:
+            self.animations.set_max_fps(self.max_fps.get())
+        except tk.TclError:
+            pass
     
     def create_led_grid(self):
         self.led_buttons = []
@@ -119,32 +243,17 @@ class LEDController:
         
         # Set color based on state
         if self.led_states[led_num]:
-            r, g, b = self.hex_to_rgb(self.selected_color)
+            color = self.hex_to_rgb(self.selected_color)
         else:
-            r, g, b = 0, 0, 0
-            
-        message = {
-            "leds": [{
-                "i": led_num,
-                "r": r,
-                "g": g,
-                "b": b
-            }],
-            "brightness": self.brightness.get()
-        }
-        self.publish_message(message)
+            color = (0, 0, 0)
+        self.animations.set_led(led_num, color)
 
     def all_on(self):
         if not self.current_board.get():
             self.status_var.set("No board selected!")
             return
         
-        r, g, b = self.hex_to_rgb(self.selected_color)
-        message = {
-            "leds": [{"i": i, "r": r, "g": g, "b": b} for i in range(self.num_leds)],
-            "brightness": self.brightness.get()
-        }
-        self.publish_message(message)
+        self.animations.set_all([self.hex_to_rgb(self.selected_color)] * self.num_leds)
         self.led_states = [True] * self.num_leds
 
     def all_off(self):
@@ -152,11 +261,8 @@ class LEDController:
             self.status_var.set("No board selected!")
             return
         
-        message = {
-            "leds": [{"i": i, "r": 0, "g": 0, "b": 0} for i in range(self.num_leds)],
-            "brightness": self.brightness.get()
-        }
-        self.publish_message(message)
+        self.animations.stop_all()
+        self.animations.set_all([(0, 0, 0)] * self.num_leds)
         self.led_states = [False] * self.num_leds
         
     def chase_pattern(self):
@@ -164,23 +270,17 @@ class LEDController:
             self.status_var.set("No board selected!")
             return
             
-        def chase():
-            r, g, b = self.hex_to_rgb(self.selected_color)
-            while True:
-                for i in range(self.num_leds):
-                    message = {
-                        "leds": [
-                            {"i": i, "r": r, "g": g, "b": b},
-                            {"i": (i-1) % self.num_leds, "r": 0, "g": 0, "b": 0}
-                        ],
-                        "brightness": self.brightness.get()
-                    }
-                    self.publish_message(message)
-                    time.sleep(0.1)
-        
-        # Start chase in background thread
-        chase_thread = threading.Thread(target=chase, daemon=True)
-        chase_thread.start()
+        color = self.hex_to_rgb(self.selected_color)
+        num_leds = self.num_leds
+
+        def chase(step):
+            return {step % num_leds: color}
+
+        # Replaces a running chase instead of starting another one
+        self.animations.start_pattern("chase", chase, step_interval=0.1)
+
+    def stop_patterns(self):
+        self.animations.stop_all()
         
     def rainbow_pattern(self):
         if not self.current_board.get():
@@ -194,20 +294,19 @@ class LEDController:
             r = int(rgb[0] * 255)
             g = int(rgb[1] * 255)
             b = int(rgb[2] * 255)
-            leds.append({"i": i, "r": r, "g": g, "b": b})
+            leds.append((r, g, b))
         
-        message = {
-            "leds": leds,
-            "brightness": self.brightness.get()
-        }
-        self.publish_message(message)
+        self.animations.set_all(leds)
+        self.led_states = [True] * self.num_leds
     
     def on_board_select(self, event):
         selected = self.current_board.get()
         if selected:
             self.status_var.set(f"Selected board: {selected}")
-            # Reset LED states when selecting a new board
+            # Reset LED states when selecting a new board, and send the new board a full (all off) frame
             self.led_states = [False] * self.num_leds
+            self.animations.set_all([(0, 0, 0)] * self.num_leds)
+            self.animations.invalidate()
     
     def on_connect(self, client, userdata, flags, rc, properties=None):
         if rc == 0:
@@ -234,7 +333,7 @@ class LEDController:
             return
             
         topic = f"home/neopixels/{self.current_board.get()}/control"
-        self.client.publish(topic, json.dumps(message))
+        self.client.publish(topic, encode_message(message))
         self.status_var.set(f"Published to {topic}")
     
     def run(self):